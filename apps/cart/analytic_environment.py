@@ -0,0 +1,202 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from apps.cart.environment import create_cart_model
+from apps.utils.environment import BaseEnvironment
+
+
+class CartBatch(ABC):
+	"""
+	A batch of independent carts and targets, simulated with numpy rather than pymunk
+	On its guide, a cart is nothing more than an undamped point mass : impulses change its velocity right away,
+	and positions move with that velocity on each step (pymunk's order), so all of it boils down to a few array operations
+	"""
+
+	def __init__(self, size: int):
+		self.size = size
+		self.environment_size = 1500, 450
+		self.cart_size, self.cart_weight = (40, 25), 1
+		self.target_radius = 10
+		self.force_mag = 10
+
+		self.x = np.zeros(size)  # Cart position
+		self.x_dot = np.zeros(size)  # Cart velocity
+		self.target = np.zeros(size)  # Target position
+		self.died = np.zeros(size, dtype=bool)
+		self.rng = np.random.default_rng()
+
+	def seed(self, seed=None):
+		self.rng = np.random.default_rng(seed)
+
+	@abstractmethod
+	def get_input_space_size(self) -> int:
+		pass
+
+	@abstractmethod
+	def observe(self, out: np.ndarray = None) -> np.ndarray:
+		pass
+
+	@abstractmethod
+	def compute_rewards(self) -> np.ndarray:
+		pass
+
+	def get_environment_name(self) -> str:
+		return "Cart"
+
+	def targets_reached(self) -> np.ndarray:
+		return np.abs(self.x - self.target) < self.target_radius + self.cart_size[0] / 2
+
+	def reset(self, indices=None):
+		"""
+		Resets the given carts (all of them by default), drawing new positions for those which would start on their target
+		"""
+		indices = np.arange(self.size) if indices is None else np.asarray(indices)
+		self.x_dot[indices] = 0
+		self.died[indices] = False
+		while len(indices) > 0:
+			self.x[indices] = self.rng.random(len(indices)) * self.environment_size[0]
+			self.target[indices] = self.rng.random(len(indices)) * self.environment_size[0]
+			indices = indices[self.targets_reached()[indices]]
+
+	def process_input(self, actions, dt):
+		"""
+		Actions are 0 (push left), 1 (push right) or anything else (no push), one per cart
+		Pushing against the current velocity is twice as strong, like in CartEnvironment
+		"""
+		actions = np.asarray(actions)
+		impulses = np.where(actions == 0, -self.force_mag, np.where(actions == 1, self.force_mag, 0.))
+		impulses *= np.where(impulses * self.x_dot < 0, 2, 1)
+		self.x_dot += impulses / self.cart_weight
+
+		margin = self.cart_size[0] + 5
+		self.died |= self.targets_reached() | (self.x < margin) | (self.x > self.environment_size[0] - margin)
+
+	def integrate(self, dt: float):
+		self.x += self.x_dot * dt
+
+	def step(self, actions, dt: float):
+		self.process_input(actions, dt)
+		self.integrate(dt)
+
+	def base_rewards(self) -> np.ndarray:
+		distance_penalties = -np.abs(self.x - self.target) / self.environment_size[0]
+		speed_penalties = self.x_dot / 500 * np.where(self.x > self.target, -1, 1)
+		return np.where(self.targets_reached(), 10, distance_penalties + speed_penalties)
+
+
+class CartBatch_V1(CartBatch):
+
+	def get_input_space_size(self) -> int:
+		return 3
+
+	def observe(self, out: np.ndarray = None) -> np.ndarray:
+		if out is None:
+			out = np.empty((self.size, 3), dtype=np.float32)
+		out[:, 0] = self.x / self.environment_size[0] - 0.5
+		out[:, 1] = self.target / self.environment_size[0] - 0.5
+		out[:, 2] = self.x_dot
+		return out
+
+	def compute_rewards(self) -> np.ndarray:
+		return self.base_rewards()
+
+
+class CartBatch_V2(CartBatch):
+
+	def get_input_space_size(self) -> int:
+		return 2
+
+	def observe(self, out: np.ndarray = None) -> np.ndarray:
+		if out is None:
+			out = np.empty((self.size, 2), dtype=np.float32)
+		out[:, 0] = self.x / self.environment_size[0] - 0.5
+		out[:, 1] = self.target / self.environment_size[0] - 0.5
+		return out
+
+	def compute_rewards(self) -> np.ndarray:
+		return np.where(self.died & ~self.targets_reached(), -10, self.base_rewards())
+
+
+class AnalyticCartEnvironment(BaseEnvironment, ABC):
+	"""
+	Drop-in replacement for CartEnvironment, backed by a CartBatch of a single cart instead of pymunk
+	"""
+
+	def __init__(self, batch: CartBatch):
+		super().__init__()
+		self.batch = batch
+		self.rng = batch.rng
+
+	def seed(self, seed=None):
+		self.batch.seed(seed)
+		self.rng = self.batch.rng
+
+	def get_environment_name(self) -> str:
+		return self.batch.get_environment_name()
+
+	def play_step(self, actions, dt: float):
+		super().play_step(actions, dt)
+		self.batch.integrate(dt)
+
+	def process_input(self, actions, dt):
+		self.batch.process_input([-1 if actions is None else actions], dt)
+		if self.batch.died[0]:
+			self.set_state(self.STATE_DIED)
+
+	def create_model(self):
+		return create_cart_model(self.get_input_space_size(), self.get_action_space_size())
+
+	def translate_prediction_to_input(self, prediction):
+		return np.argmax(prediction)
+
+	def translate_predictions_to_inputs(self, predictions):
+		return np.argmax(predictions, axis=1)
+
+	def get_action_space_size(self) -> int:
+		return 2
+
+	def get_input_space_size(self) -> int:
+		return self.batch.get_input_space_size()
+
+	def observe(self) -> np.array:
+		return self.batch.observe()
+
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		self.batch.observe(buffer[row:row + 1])
+
+	def random_input(self) -> int:
+		return int(self.rng.random() < 0.5)
+
+	def get_environment_size(self) -> tuple[int, int]:
+		return self.batch.environment_size
+
+	def setup_environment(self):
+		pass
+
+	def reset_environment(self):
+		self.batch.reset()
+
+	def compute_reward(self) -> float:
+		return float(self.batch.compute_rewards()[0])
+
+	def draw(self, screen):
+		import pygame
+
+		b, height = self.batch, self.get_environment_size()[1]
+		cart = pygame.Rect(0, 0, *b.cart_size)
+		cart.center = b.x[0], height / 2
+		pygame.draw.rect(screen, (100, 100, 100), cart)
+		pygame.draw.circle(screen, (0, 255, 0), (b.target[0], height / 2), b.target_radius)
+
+
+class AnalyticCartEnvironment_V1(AnalyticCartEnvironment):
+
+	def __init__(self):
+		super().__init__(CartBatch_V1(1))
+
+
+class AnalyticCartEnvironment_V2(AnalyticCartEnvironment):
+
+	def __init__(self):
+		super().__init__(CartBatch_V2(1))
@@ -1,11 +1,27 @@
-import random
 from abc import ABC
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pymunk
 
 from apps.utils.environment import PhysicsEnvironment
 
+if TYPE_CHECKING:
+	import keras
+
+
+def create_cart_model(input_space_size: int, action_space_size: int) -> 'keras.Model':
+	from keras import Sequential
+	from keras.src.layers import Dense
+	from keras.src.optimizers import Adam
+	model = Sequential([
+		Dense(64, activation='relu', kernel_initializer='random_normal', input_shape=(input_space_size,)),
+		Dense(32, activation='relu', kernel_initializer='random_normal'),
+		Dense(action_space_size, activation='softmax', kernel_initializer='random_normal')
+	])
+	model.compile(loss="mse", optimizer=Adam(learning_rate=0.001))
+	return model
+
 
 class CartEnvironment(PhysicsEnvironment, ABC):
 	"""
@@ -16,8 +32,8 @@ class CartEnvironment(PhysicsEnvironment, ABC):
 	Yeepee, it finally worked, just needed some tweaking with penalty for smashing the screen borders
 	"""
 
-	def __init__(self):
-		super().__init__()
+	def __init__(self, physics_profile=None):
+		super().__init__(physics_profile)
 		es = self.get_environment_size()
 
 		self.cart_size, self.cart_weight = (40, 25), 1
@@ -31,16 +47,17 @@ class CartEnvironment(PhysicsEnvironment, ABC):
 		self.cart_body = pymunk.Body(self.cart_weight, pymunk.moment_for_box(self.cart_weight, self.cart_size))
 		self.cart_poly = pymunk.Poly.create_box(self.cart_body, self.cart_size)
 
-		self.get_space().iterations = 20
-
 	def translate_prediction_to_input(self, prediction):
 		return np.argmax(prediction)
 
+	def translate_predictions_to_inputs(self, predictions):
+		return np.argmax(predictions, axis=1)
+
 	def get_action_space_size(self) -> int:
 		return 2  # Left or right
 
 	def random_input(self) -> int:
-		return int(random.random() < 0.5)
+		return int(self.rng.random() < 0.5)
 
 	def get_environment_size(self) -> tuple[int, int]:
 		return 1500, 450
@@ -66,26 +83,23 @@ class CartEnvironment(PhysicsEnvironment, ABC):
 		dist = abs(self.cart_body.position.x - self.target.x)
 		return dist < self.target_radius + self.cart_size[0] / 2
 
-	def create_model(self):
-		from keras import Sequential
-		from keras.src.layers import Dense
-		from keras.src.optimizers import Adam
-		model = Sequential([
-			Dense(64, activation='relu', kernel_initializer='random_normal', input_shape=(self.get_input_space_size(),)),
-			Dense(32, activation='relu', kernel_initializer='random_normal'),
-			Dense(self.get_action_space_size(), activation='softmax', kernel_initializer='random_normal')
-		])
-		model.compile(loss="mse", optimizer=Adam(learning_rate=0.001))
-		return model
+	def create_model(self) -> 'keras.Model':
+		return create_cart_model(self.get_input_space_size(), self.get_action_space_size())
 
 	def reset_environment(self):
 		self.cart_body.velocity = 0, 0
 		once = False
 		while not once or self.target_reached():
-			self.cart_body.position = random.random() * self.get_environment_size()[0], self.get_environment_size()[1] / 2
-			self.target = pymunk.Vec2d(random.random() * self.get_environment_size()[0], self.get_environment_size()[1] / 2)
+			self.cart_body.position = self.rng.random() * self.get_environment_size()[0], self.get_environment_size()[1] / 2
+			self.target = pymunk.Vec2d(self.rng.random() * self.get_environment_size()[0], self.get_environment_size()[1] / 2)
 			once = True
 
+	def get_extra_state(self) -> list[float]:
+		return [self.target.x, self.target.y]
+
+	def set_extra_state(self, values: list[float]):
+		self.target = pymunk.Vec2d(*values)
+
 	def setup_environment(self):
 		width, height = self.get_environment_size()
 
@@ -96,6 +110,7 @@ class CartEnvironment(PhysicsEnvironment, ABC):
 
 		self.get_space().add(self.guide, self.guide.body, self.cart_body, self.cart_poly)
 		self.get_space().add(groove_joint_1, groove_joint_2)
+		self.on_space_changed()
 
 
 class CartEnvironment_V1(CartEnvironment):
@@ -103,12 +118,9 @@ class CartEnvironment_V1(CartEnvironment):
 	def get_input_space_size(self) -> int:
 		return 3
 
-	def observe(self) -> np.array:
-		return np.array([[
-			(self.cart_body.position.x / self.get_environment_size()[0]) - 0.5,
-			(self.target.x / self.get_environment_size()[0]) - 0.5,
-			self.cart_body.velocity.x
-		]])
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		width = self.get_environment_size()[0]
+		buffer[row] = self.cart_body.position.x / width - 0.5, self.target.x / width - 0.5, self.cart_body.velocity.x
 
 	def compute_reward(self) -> float:
 		if self.target_reached():
@@ -123,11 +135,9 @@ class CartEnvironment_V2(CartEnvironment):
 	def get_input_space_size(self) -> int:
 		return 2
 
-	def observe(self) -> np.array:
-		return np.array([[
-			(self.cart_body.position.x / self.get_environment_size()[0]) - 0.5,
-			(self.target.x / self.get_environment_size()[0]) - 0.5
-		]])
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		width = self.get_environment_size()[0]
+		buffer[row] = self.cart_body.position.x / width - 0.5, self.target.x / width - 0.5
 
 	def compute_reward(self) -> float:
 		if self.target_reached():
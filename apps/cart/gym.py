@@ -11,23 +11,37 @@ from apps.utils.learning_modes import DQN
 MODE_TRAIN = 0
 MODE_SHOWCASE = 1
 
-# Create output dir
-if not os.path.exists("models"):
-	os.mkdir("models")
-
-env = CartEnvironment_V2()
-
-gym = BaseGym(
-	env,
-	DQN(env, ReplayBuffer(5000, 128)),
-	TrainingSettings(
-		episode_time=400, observe=10000, epsilon=Epsilon.simple(1, 0.05, 0.999),
-		save_interval=200, save_path=str(pathlib.Path("models/cart_{eps}.h5").absolute()),
-		train_after=TrainingSettings.TRAIN_AFTER_EPISODES,
-		train_policy=lambda gym_stats, episode_stats: gym_stats.get_episode_count() % 10 == 0
-	),
-	weights=None
-)
-while True:
-	if gym.step() == BaseGym.RESULT_GYM_STOPPED:
-		break
+
+def build_gym(
+		episode_time: int = 400, observe: int = 10000, epsilon_start: float = 1, epsilon_end: float = 0.05, epsilon_decay: float = 0.999,
+		memory_size: int = 5000, batch_size: int = 128, gamma: float = 0.99, update_period: int = 1000, train_every: int = 10,
+		save_interval: int = 200, episodes: int = 0, action_repeat: int = 1, physics_profile: str = "balanced", **kwargs
+) -> BaseGym:
+	"""
+	Training session with every hyperparameter exposed (see apps.utils.sweep), other keyword arguments go to the gym
+	train_every => Train after every this many episodes
+	physics_profile => See PhysicsProfile, "fast" trades some accuracy for speed
+	"""
+	env = CartEnvironment_V2(physics_profile)
+	return BaseGym(
+		env,
+		DQN(env, ReplayBuffer(memory_size, batch_size, env.get_input_space_size()), gamma=gamma, update_period=update_period),
+		TrainingSettings(
+			episodes=episodes, episode_time=episode_time, action_repeat=action_repeat, observe=observe, epsilon=Epsilon.simple(epsilon_start, epsilon_end, epsilon_decay),
+			save_interval=save_interval, save_path=str(pathlib.Path("models/cart_{eps}.h5").absolute()),
+			train_after=TrainingSettings.TRAIN_AFTER_EPISODES,
+			train_policy=lambda gym_stats, episode_stats: gym_stats.get_episode_count() % train_every == 0
+		),
+		**kwargs
+	)
+
+
+if __name__ == "__main__":
+	# Create output dir
+	if not os.path.exists("models"):
+		os.mkdir("models")
+
+	gym = build_gym(weights=None)
+	while True:
+		if gym.step() == BaseGym.RESULT_GYM_STOPPED:
+			break
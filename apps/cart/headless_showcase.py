@@ -0,0 +1,10 @@
+from apps.cart.environment import CartEnvironment_V2
+from apps.utils.headless import HeadlessRunner
+from apps.utils.inference import NumpyPolicy
+
+env = CartEnvironment_V2()
+
+model = env.create_model()
+model.load_weights("models/sp_30000.h5")
+runner = HeadlessRunner(env, NumpyPolicy.from_keras(model), render_every=0)  # e.g. render_every=5, frames_dir="../../captures/frames"
+runner.run(episodes=10, max_ticks=5000)
@@ -0,0 +1,228 @@
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from apps.cart_pole.environment import create_cart_pole_model
+from apps.utils.environment import BaseEnvironment
+
+
+class CartPoleBatch(ABC):
+	"""
+	A batch of independent cart-poles, integrated with the closed-form equations of motion rather than a pymunk space
+	Everything mirrors CartPoleEnvironment : sizes, masses and units (pixels), angles (counter-clockwise, 0 when the pole stands up),
+	and the step order (input and death checks first, then the same Euler step as pymunk)
+	"""
+
+	def __init__(self, size: int):
+		self.size = size
+		self.environment_size = 1500, 450
+		self.cart_size, self.cart_weight = (40, 25), 1
+		self.pole_size, self.pole_weight = (5, 70), 0.1
+		self.max_angle = math.pi * 20 / 180
+		self.gravity = 981
+		self.force_mag = 200
+
+		self.pole_length = self.pole_size[1] / 2  # Distance from the pivot to the pole's center of mass
+		self.pole_moment = self.pole_weight * (self.pole_size[0] ** 2 + self.pole_size[1] ** 2) / 12
+
+		self.x = np.zeros(size)  # Cart position
+		self.x_dot = np.zeros(size)  # Cart velocity
+		self.theta = np.zeros(size)  # Pole angle
+		self.theta_dot = np.zeros(size)  # Pole angular velocity
+		self.died = np.zeros(size, dtype=bool)
+		self.forces = np.zeros(size)
+		self.rng = np.random.default_rng()
+
+	def seed(self, seed=None):
+		self.rng = np.random.default_rng(seed)
+
+	@abstractmethod
+	def get_environment_name(self) -> str:
+		pass
+
+	@abstractmethod
+	def compute_rewards(self) -> np.ndarray:
+		pass
+
+	def reset(self, indices=None):
+		"""
+		Resets the given cart-poles (all of them by default) the same way CartPoleEnvironment.reset_environment does
+		"""
+		if indices is None:
+			indices = np.arange(self.size)
+		count = len(indices)
+		self.x_dot[indices] = self.rng.random(count) / 9
+		self.x[indices] = self.environment_size[0] / 2 + self.rng.random(count) / 9
+		self.theta[indices] = self.rng.random(count) / 9
+		self.theta_dot[indices] = 0
+		self.died[indices] = False
+
+	def process_input(self, actions, dt):
+		"""
+		Actions are 0 (push left), 1 (push right) or anything else (no push), one per cart-pole
+		"""
+		actions = np.asarray(actions)
+		self.forces = np.where(actions == 0, -self.force_mag * self.cart_weight, np.where(actions == 1, self.force_mag * self.cart_weight, 0.))
+		self.died |= ~((-self.max_angle < self.theta) & (self.theta < self.max_angle))
+
+	def integrate(self, dt: float):
+		m, total_mass, l = self.pole_weight, self.cart_weight + self.pole_weight, self.pole_length
+		sin, cos = np.sin(self.theta), np.cos(self.theta)
+
+		temp = (self.forces - m * l * self.theta_dot ** 2 * sin) / total_mass
+		theta_acc = (m * self.gravity * l * sin + m * l * cos * temp) / (self.pole_moment + m * l ** 2 - (m * l * cos) ** 2 / total_mass)
+		x_acc = temp + m * l * theta_acc * cos / total_mass
+
+		# Like pymunk, positions move with the velocities from the previous step, then velocities are updated
+		self.x += self.x_dot * dt
+		self.theta += self.theta_dot * dt
+		self.x_dot += x_acc * dt
+		self.theta_dot += theta_acc * dt
+
+	def step(self, actions, dt: float):
+		self.process_input(actions, dt)
+		self.integrate(dt)
+
+	def observe(self, out: np.ndarray = None) -> np.ndarray:
+		if out is None:
+			out = np.empty((self.size, 4), dtype=np.float32)
+		out[:, 0] = self.x / self.environment_size[0] - 0.5
+		out[:, 1] = self.x_dot / 200
+		out[:, 2] = self.theta
+		out[:, 3] = self.theta_dot
+		return out
+
+	def angle_rewards(self) -> np.ndarray:
+		return 1 - np.abs(self.theta) / self.max_angle
+
+
+class CartPoleBatch_V1(CartPoleBatch):
+
+	def get_environment_name(self) -> str:
+		return "CartPole_V1"
+
+	def compute_rewards(self) -> np.ndarray:
+		return np.where(self.died, -5, self.angle_rewards())
+
+
+class CartPoleBatch_V2(CartPoleBatch):
+
+	def get_environment_name(self) -> str:
+		return "CartPole_V2"
+
+	def compute_rewards(self) -> np.ndarray:
+		distance_rewards = 1 - 10 * np.abs(self.x / self.environment_size[0] - 0.5)
+		return np.where(self.died, -5, (self.angle_rewards() + distance_rewards) / 2)
+
+
+class CartPoleBatch_V3(CartPoleBatch):
+
+	def __init__(self, size: int):
+		super().__init__(size)
+		self.max_distance = self.environment_size[0] / 6
+		self.min_x, self.max_x = self.environment_size[0] / 2 - self.max_distance, self.environment_size[0] / 2 + self.max_distance
+
+	def get_environment_name(self) -> str:
+		return "CartPole_V3"
+
+	def process_input(self, actions, dt):
+		super().process_input(actions, dt)
+		self.died |= ~((self.min_x < self.x) & (self.x < self.max_x))
+
+	def compute_rewards(self) -> np.ndarray:
+		distance_rewards = 1 - 2 * np.abs(self.x / self.environment_size[0] - 0.5)
+		return np.where(self.died, -10, (self.angle_rewards() + distance_rewards) / 2)
+
+
+class AnalyticCartPoleEnvironment(BaseEnvironment, ABC):
+	"""
+	Drop-in replacement for CartPoleEnvironment, backed by a CartPoleBatch of a single cart-pole instead of pymunk
+	"""
+
+	def __init__(self, batch: CartPoleBatch):
+		super().__init__()
+		self.batch = batch
+		self.rng = batch.rng
+
+	def seed(self, seed=None):
+		self.batch.seed(seed)
+		self.rng = self.batch.rng
+
+	def get_environment_name(self) -> str:
+		return self.batch.get_environment_name()
+
+	def play_step(self, actions, dt: float):
+		super().play_step(actions, dt)
+		self.batch.integrate(dt)
+
+	def process_input(self, actions, dt):
+		self.batch.process_input([-1 if actions is None else actions], dt)
+		if self.batch.died[0]:
+			self.set_state(self.STATE_DIED)
+
+	def create_model(self):
+		return create_cart_pole_model(self.get_input_space_size(), self.get_action_space_size())
+
+	def translate_prediction_to_input(self, prediction):
+		return np.argmax(prediction)
+
+	def translate_predictions_to_inputs(self, predictions):
+		return np.argmax(predictions, axis=1)
+
+	def get_action_space_size(self) -> int:
+		return 2
+
+	def get_input_space_size(self) -> int:
+		return 4
+
+	def observe(self) -> np.array:
+		return self.batch.observe()
+
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		self.batch.observe(buffer[row:row + 1])
+
+	def random_input(self) -> int:
+		return int(self.rng.random() < 0.5)
+
+	def get_environment_size(self) -> tuple[int, int]:
+		return self.batch.environment_size
+
+	def setup_environment(self):
+		pass
+
+	def reset_environment(self):
+		self.batch.reset()
+
+	def compute_reward(self) -> float:
+		return float(self.batch.compute_rewards()[0])
+
+	def draw(self, screen):
+		import pygame
+
+		b, height = self.batch, self.get_environment_size()[1]
+		cart = pygame.Rect(0, 0, *b.cart_size)
+		cart.center = b.x[0], height / 2
+		pygame.draw.rect(screen, (100, 100, 100), cart)
+
+		pivot = b.x[0], height / 2 - b.cart_size[1] / 2
+		tip = pivot[0] - math.sin(b.theta[0]) * b.pole_size[1], pivot[1] - math.cos(b.theta[0]) * b.pole_size[1]
+		pygame.draw.line(screen, (50, 50, 200), pivot, tip, b.pole_size[0])
+
+
+class AnalyticCartPoleEnvironment_V1(AnalyticCartPoleEnvironment):
+
+	def __init__(self):
+		super().__init__(CartPoleBatch_V1(1))
+
+
+class AnalyticCartPoleEnvironment_V2(AnalyticCartPoleEnvironment):
+
+	def __init__(self):
+		super().__init__(CartPoleBatch_V2(1))
+
+
+class AnalyticCartPoleEnvironment_V3(AnalyticCartPoleEnvironment):
+
+	def __init__(self):
+		super().__init__(CartPoleBatch_V3(1))
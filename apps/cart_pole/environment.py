@@ -1,21 +1,33 @@
 import math
-import random
 from abc import ABC
+from typing import TYPE_CHECKING
 
-import keras
 import numpy as np
 import pymunk
-from keras import Sequential
-from keras.src.layers import Dense
-from keras.src.optimizers import Adam
 
 from apps.utils.environment import PhysicsEnvironment
 
+if TYPE_CHECKING:
+	import keras
+
+
+def create_cart_pole_model(input_space_size: int, action_space_size: int) -> 'keras.Model':
+	from keras import Sequential
+	from keras.src.layers import Dense
+	from keras.src.optimizers import Adam
+	model = Sequential([
+		Dense(64, activation='relu', kernel_initializer='random_normal', input_shape=(input_space_size,)),
+		Dense(64, activation='relu', kernel_initializer='random_normal'),
+		Dense(action_space_size, activation='linear', kernel_initializer='random_normal')
+	])
+	model.compile(loss="mse", optimizer=Adam(learning_rate=0.001))
+	return model
+
 
 class CartPoleEnvironment(PhysicsEnvironment, ABC):
 
-	def __init__(self):
-		super().__init__()
+	def __init__(self, physics_profile=None):
+		super().__init__(physics_profile)
 		es = self.get_environment_size()
 
 		self.cart_size, self.cart_weight = (40, 25), 1
@@ -32,27 +44,24 @@ class CartPoleEnvironment(PhysicsEnvironment, ABC):
 		self.pole_poly = pymunk.Poly.create_box(self.pole_body, self.pole_size)
 		self.pole_poly.sensor = True
 
-		self.get_space().iterations = 20
-
 	def translate_prediction_to_input(self, prediction):
 		return np.argmax(prediction)
 
+	def translate_predictions_to_inputs(self, predictions):
+		return np.argmax(predictions, axis=1)
+
 	def get_action_space_size(self) -> int:
 		return 2
 
 	def get_input_space_size(self) -> int:
 		return 4
 
-	def observe(self) -> np.array:
-		return np.array([[
-			(self.cart_body.position.x / self.get_environment_size()[0]) - 0.5,
-			self.cart_body.velocity.x / 200,
-			self.pole_body.angle,
-			self.pole_body.angular_velocity
-		]])
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		pole = self.pole_body
+		buffer[row] = self.cart_body.position.x / self.get_environment_size()[0] - 0.5, self.cart_body.velocity.x / 200, pole.angle, pole.angular_velocity
 
 	def random_input(self) -> int:
-		return int(random.random() < 0.5)
+		return int(self.rng.random() < 0.5)
 
 	def get_environment_size(self) -> tuple[int, int]:
 		return 1500, 450
@@ -68,10 +77,11 @@ class CartPoleEnvironment(PhysicsEnvironment, ABC):
 
 		self.get_space().add(self.guide, self.guide.body, self.cart_body, self.cart_poly, self.pole_body, self.pole_poly)
 		self.get_space().add(pivot, groove_joint_1, groove_joint_2)
+		self.on_space_changed()
 
 	def reset_environment(self):
 		def get_random_value() -> float:
-			return random.random() / 9
+			return self.rng.random() / 9
 
 		self.cart_body.velocity = get_random_value(), 0
 		self.cart_body.position = self.get_environment_size()[0] / 2 + get_random_value(), self.get_environment_size()[1] / 2
@@ -89,14 +99,8 @@ class CartPoleEnvironment(PhysicsEnvironment, ABC):
 		if not -self.max_angle < self.pole_body.angle < self.max_angle:
 			self.set_state(self.STATE_DIED)
 
-	def create_model(self) -> keras.Model:
-		model = Sequential([
-			Dense(64, activation='relu', kernel_initializer='random_normal', input_shape=(self.get_input_space_size(),)),
-			Dense(64, activation='relu', kernel_initializer='random_normal'),
-			Dense(self.get_action_space_size(), activation='linear', kernel_initializer='random_normal')
-		])
-		model.compile(loss="mse", optimizer=Adam(learning_rate=0.001))
-		return model
+	def create_model(self) -> 'keras.Model':
+		return create_cart_pole_model(self.get_input_space_size(), self.get_action_space_size())
 
 
 class CartPoleEnvironment_V1(CartPoleEnvironment):
@@ -128,8 +132,8 @@ class CartPoleEnvironment_V2(CartPoleEnvironment):
 
 class CartPoleEnvironment_V3(CartPoleEnvironment):
 
-	def __init__(self):
-		super().__init__()
+	def __init__(self, physics_profile=None):
+		super().__init__(physics_profile)
 		self.max_distance = self.get_environment_size()[0] / 6
 		self.min_x, self.max_x = self.get_environment_size()[0] / 2 - self.max_distance, self.get_environment_size()[0] / 2 + self.max_distance
 
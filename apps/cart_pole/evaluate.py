@@ -0,0 +1,10 @@
+import functools
+import glob
+
+from apps.cart_pole.environment import CartPoleEnvironment_V3
+from apps.utils.evaluation import evaluate, format_report
+
+if __name__ == "__main__":  # Workers are spawned, they re-import this module
+	checkpoints = sorted(glob.glob("models/*.h5"))
+	results = evaluate(functools.partial(CartPoleEnvironment_V3, "accurate"), checkpoints, episodes=100, envs=32, max_ticks=5000, seed=0)
+	print(format_report(results))
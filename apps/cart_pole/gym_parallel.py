@@ -0,0 +1,22 @@
+import pathlib
+
+from apps.cart_pole.environment import CartPoleEnvironment_V3
+from apps.utils.gym import BaseGym
+from apps.utils.gym_utils import Epsilon, TrainingSettings, ReplayBuffer
+from apps.utils.learning_modes import DQN
+from apps.utils.rollout import RolloutPool, ParallelGym
+
+if __name__ == "__main__":  # Workers are spawned, they re-import this module
+	env = CartPoleEnvironment_V3()
+
+	gym = ParallelGym(
+		RolloutPool(CartPoleEnvironment_V3, envs_per_worker=8, epsilon=Epsilon.simple(0.25, 0.05, 0.999), episode_time=1000),
+		DQN(env, ReplayBuffer(100000, 128, env.get_input_space_size())),
+		TrainingSettings(
+			observe=10000, save_interval=1000, save_path=str(pathlib.Path("models/cartpole_{eps}.h5").absolute())
+		),
+		weights="models/sp_31000.h5"
+	)
+	while True:
+		if gym.step() == BaseGym.RESULT_GYM_STOPPED:
+			break
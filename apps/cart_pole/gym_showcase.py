@@ -1,10 +1,11 @@
 from apps.cart_pole.ai_debug_environment import CartPoleAiDebugEnvironment
 from apps.cart_pole.environment import *
 from apps.utils.gym_utils import Epsilon
+from apps.utils.inference import NumpyPolicy
 
-env = CartPoleEnvironment_V3()
+env = CartPoleEnvironment_V3("accurate")
 
 model = env.create_model()
 model.load_weights("models/sp_31000.h5")
-debug_env = CartPoleAiDebugEnvironment(env, model, Epsilon.constant(0))
+debug_env = CartPoleAiDebugEnvironment(env, NumpyPolicy.from_keras(model), Epsilon.constant(0))
 debug_env.run()
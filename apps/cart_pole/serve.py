@@ -0,0 +1,6 @@
+from apps.cart_pole.environment import CartPoleEnvironment_V3
+from apps.utils.serving import PolicyServer
+
+# Point weights at a training session's save_path to follow it as it saves new checkpoints
+server = PolicyServer(CartPoleEnvironment_V3(), "models/sp_31000.h5", max_batch_size=64, max_wait=0.002, reload_interval=1.)
+server.run(port=8765)  # or path="/tmp/cartpole.sock" for a Unix socket
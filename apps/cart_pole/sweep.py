@@ -0,0 +1,18 @@
+from apps.cart_pole.gym import build_gym
+from apps.utils.sweep import EarlyStopping, random_search, log_uniform, run_sweep, format_table, write_csv
+
+if __name__ == "__main__":  # Workers are spawned, they re-import this module
+	trials = random_search({
+		"observe": [1000, 5000, 10000],
+		"epsilon_start": (0.1, 1.),
+		"epsilon_decay": log_uniform(0.99, 0.9995),
+		"batch_size": [32, 64, 128],
+		"gamma": [0.95, 0.99],
+		"update_period": (100, 2000),
+		"train_every": [1, 5, 10],
+		"save_interval": [0],
+	}, trials=16, seed=0)
+
+	results = run_sweep(build_gym, trials, threads_per_worker=1, max_episodes=2000, early_stopping=EarlyStopping(grace=200, patience=300), seed=0)
+	print(format_table(results))
+	write_csv("sweep_cartpole.csv", results)
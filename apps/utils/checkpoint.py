@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from apps.utils.environment import BaseEnvironment
+from apps.utils.gym_utils import Epsilon, GymStatistics
+
+if TYPE_CHECKING:
+	from apps.utils.learning_modes import LearningMode
+
+SESSION_FORMAT = 1
+
+
+def session_path(path: str) -> str:
+	return path + ".session"
+
+
+def _temporary(path: str) -> str:
+	root, ext = os.path.splitext(path)
+	return root + ".tmp" + ext  # Keeps the extension, keras picks the file format from it
+
+
+def _write_part(directory: str, name: str, snapshot: dict) -> dict:
+	"""
+	Writes the arrays (and lists of arrays) of a snapshot as .npy files
+	:returns: Everything else, to be written as JSON, along with the list of those arrays
+	"""
+	values, arrays = {}, {}
+	for key, value in snapshot.items():
+		if isinstance(value, np.ndarray):
+			np.save(os.path.join(directory, "%s.%s.npy" % (name, key)), value)
+			arrays[key] = None
+		elif isinstance(value, list) and len(value) > 0 and all(isinstance(item, np.ndarray) for item in value):
+			for i, item in enumerate(value):
+				np.save(os.path.join(directory, "%s.%s.%d.npy" % (name, key, i)), item)
+			arrays[key] = len(value)
+		else:
+			values[key] = value.item() if isinstance(value, np.generic) else value
+	return {"values": values, "arrays": arrays}
+
+
+def _read_part(directory: str, name: str, part: dict, mmap_mode: str = None) -> dict:
+	snapshot = dict(part["values"])
+	for key, count in part["arrays"].items():
+		if count is None:
+			snapshot[key] = np.load(os.path.join(directory, "%s.%s.npy" % (name, key)), mmap_mode=mmap_mode)
+		else:
+			snapshot[key] = [np.load(os.path.join(directory, "%s.%s.%d.npy" % (name, key, i)), mmap_mode=mmap_mode) for i in range(count)]
+	return snapshot
+
+
+class Checkpointer:
+	"""
+	Saves checkpoints without holding the training loop up, and loads them back to resume a training session
+	The live state is copied in memory right away, then written by a background thread through a shadow copy of the model,
+	while training goes on with the original one
+	A checkpoint is made of the model file itself (same format as LearningMode.save, so it can be used on its own) and of a
+	<path>.session directory, holding the rest of the training state :
+		session.json => Epsilon, gym statistics, learning mode counters, random generators (environments included), extra values, and the list of the arrays below
+		replay.*.npy => Replay memory columns, loaded back memory-mapped so that big memories aren't copied around
+		mode.*.npy => Learning mode state (target network, optimizer slots)
+	Everything is written under a temporary name first, so that a checkpoint is never left half written
+	Only the last `keep` checkpoints are kept on disk (all of them with 0)
+	The writer thread only starts with the first save, and is stopped by close(), which also lets go of the learning mode
+	(pending checkpoints are still written if the interpreter exits before that)
+	"""
+
+	def __init__(self, mode: 'LearningMode', epsilon: Epsilon = None, gym_stats: GymStatistics = None, keep: int = 0, save_replay: bool = True, max_pending: int = 2, envs: list[BaseEnvironment] = None):
+		self.mode = mode
+		self.epsilon = epsilon
+		self.gym_stats = gym_stats
+		self.envs = envs or []
+		self.keep = keep
+		self.save_replay = save_replay
+		self.shadow_model = None
+		self.saved = deque()
+		self.errors = []
+		self.jobs = queue.Queue(maxsize=max_pending)  # Bounds the memory held by pending snapshots, save() waits past that
+		self.thread = None
+
+	def save(self, path: str, **extra):
+		"""
+		Snapshots the current state and queues it to be written at the given path
+		Extra keyword arguments are written to session.json (they must be JSON serializable)
+		"""
+		if self.thread is None:
+			self.thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+			self.thread.start()
+			atexit.register(self.flush)
+		if self.shadow_model is None:
+			import keras
+			self.shadow_model = keras.models.clone_model(self.mode.get_model())  # Built on the caller's thread, only its weights change later
+		memory = getattr(self.mode, "memory", None)
+		parts = {"mode": self.mode.snapshot()}
+		if self.save_replay and memory is not None:
+			parts["replay"] = memory.snapshot()
+		if self.gym_stats is not None:
+			parts["gym_stats"] = self.gym_stats.snapshot()
+		if self.epsilon is not None:
+			parts["epsilon"] = self.epsilon.snapshot()
+		if self.envs:
+			parts["envs"] = {"rng": [env.rng.bit_generator.state for env in self.envs]}
+		self.jobs.put((path, self.mode.get_model().get_weights(), parts, extra))
+
+	def _run(self):
+		while True:
+			job = self.jobs.get()
+			if job is None:  # Sent by close()
+				self.jobs.task_done()
+				return
+			try:
+				self._write(*job)
+			except Exception as e:
+				self.errors.append(e)
+				print("> Checkpoint %s couldn't be saved: %r" % (job[0], e))
+			finally:
+				self.jobs.task_done()
+
+	def _write(self, path: str, weights: list, parts: dict, extra: dict):
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+
+		self.shadow_model.set_weights(weights)
+		self.shadow_model.save(_temporary(path))
+
+		session, temporary_session = session_path(path), session_path(path) + ".tmp"
+		shutil.rmtree(temporary_session, ignore_errors=True)
+		os.makedirs(temporary_session)
+		manifest = {"format": SESSION_FORMAT, "extra": extra}
+		for name, snapshot in parts.items():
+			manifest[name] = _write_part(temporary_session, name, snapshot)
+		with open(os.path.join(temporary_session, "session.json"), "w") as f:
+			json.dump(manifest, f)
+
+		os.replace(_temporary(path), path)
+		shutil.rmtree(session, ignore_errors=True)
+		os.replace(temporary_session, session)
+
+		if path in self.saved:
+			self.saved.remove(path)
+		self.saved.append(path)
+		while 0 < self.keep < len(self.saved):
+			self._delete(self.saved.popleft())
+
+	@staticmethod
+	def _delete(path: str):
+		if os.path.exists(path):
+			os.remove(path)
+		shutil.rmtree(session_path(path), ignore_errors=True)
+
+	def flush(self):
+		"""
+		Waits for every queued checkpoint to be written
+		"""
+		self.jobs.join()
+
+	def close(self):
+		"""
+		Waits for every queued checkpoint to be written, then stops the writer thread (a later save starts a new one)
+		"""
+		if self.thread is None:
+			return
+		self.jobs.put(None)
+		self.thread.join()
+		self.thread = None
+		atexit.unregister(self.flush)
+		self.shadow_model = None
+
+	def restore(self, path: str) -> dict:
+		"""
+		Loads a checkpoint back into the learning mode, its replay memory, the epsilon and the gym statistics (whichever parts were saved)
+		A model file without any session directory (e.g. saved before sessions existed) only restores the weights
+		Replay arrays are memory-mapped copy-on-write : the files are never modified, and only the pages actually used are read
+		Environments get their random generators back, but not the episodes they were playing : those start over, so a resumed
+		VectorGym (or ParallelGym) doesn't play exactly what the interrupted session would have
+		:returns: The extra values saved along with the checkpoint
+		"""
+		self.mode.load(path)
+		session = session_path(path)
+		if not os.path.exists(os.path.join(session, "session.json")):
+			return {}
+		with open(os.path.join(session, "session.json")) as f:
+			manifest = json.load(f)
+		if manifest.get("format") != SESSION_FORMAT:
+			raise ValueError("Unsupported session format %r in %s" % (manifest.get("format"), session))
+
+		self.mode.restore(_read_part(session, "mode", manifest["mode"]))
+		memory = getattr(self.mode, "memory", None)
+		if memory is not None and "replay" in manifest:
+			memory.restore(_read_part(session, "replay", manifest["replay"], mmap_mode='c'))
+		if self.gym_stats is not None and "gym_stats" in manifest:
+			self.gym_stats.restore(_read_part(session, "gym_stats", manifest["gym_stats"]))
+		if self.epsilon is not None and "epsilon" in manifest:
+			self.epsilon.restore(_read_part(session, "epsilon", manifest["epsilon"]))
+		if self.envs and "envs" in manifest:
+			states = manifest["envs"]["values"]["rng"]
+			if len(states) != len(self.envs):
+				raise ValueError("%s was saved with %d environments, not %d" % (session, len(states), len(self.envs)))
+			for env, state in zip(self.envs, states):
+				env.rng.bit_generator.state = state
+		return manifest["extra"]
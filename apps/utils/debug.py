@@ -7,15 +7,16 @@ import pymunk.pygame_util
 
 from apps.utils.environment import BaseEnvironment
 
-pygame.init()
-pygame.font.init()
-
 
 class SimplePygameDebugEnvironment(abc.ABC):
 
 	PLAY_SPEED = [1, 1.25, 1.5, 2, 0.25, 0.5, 0.75]
 
 	def __init__(self, env: BaseEnvironment):
+		pygame.init()
+		pygame.font.init()
+		pymunk.pygame_util.positive_y_is_up = True
+
 		self.env = env
 		self.screen = pygame.display.set_mode(env.get_environment_size())
 		self.clock = pygame.time.Clock()
@@ -1,9 +1,12 @@
+import zlib
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
 
-import keras
 import numpy as np
 import pymunk
-import pymunk.pygame_util
+
+if TYPE_CHECKING:  # Only models need keras, so environments can be used without loading tensorflow
+	import keras
 
 
 class BaseEnvironment(ABC):
@@ -19,6 +22,13 @@ class BaseEnvironment(ABC):
 
 	def __init__(self):
 		self._state = BaseEnvironment.STATE_RUNNING
+		self.rng = np.random.default_rng()  # Source of any randomness (resets, random inputs)
+
+	def seed(self, seed=None):
+		"""
+		Resets the random generator, seed being an int or a numpy SeedSequence (e.g. spawned for each of several environments)
+		"""
+		self.rng = np.random.default_rng(seed)
 
 	def get_state(self):
 		return self._state
@@ -39,6 +49,20 @@ class BaseEnvironment(ABC):
 		"""
 		self.process_input(actions, dt)
 
+	def play_steps(self, actions, dt: float, repeat: int = 1) -> tuple[float, int]:
+		"""
+		Action repeat (frame skip) : plays the same actions for `repeat` steps, stopping early if the agent dies
+		:returns: The sum of the rewards of the steps played, and how many of them were played
+		"""
+		reward, steps = 0., 0
+		while steps < repeat:
+			self.play_step(actions, dt)
+			reward += self.compute_reward()
+			steps += 1
+			if self.get_state() == self.STATE_DIED:
+				break
+		return reward, steps
+
 	@abstractmethod
 	def get_environment_name(self) -> str:
 		"""
@@ -54,7 +78,7 @@ class BaseEnvironment(ABC):
 		pass
 
 	@abstractmethod
-	def create_model(self) -> keras.Model:
+	def create_model(self) -> 'keras.Model':
 		"""
 		Creates a new model to be used to solve the environment
 		"""
@@ -67,6 +91,12 @@ class BaseEnvironment(ABC):
 		"""
 		pass
 
+	def translate_predictions_to_inputs(self, predictions):
+		"""
+		Batched version of translate_prediction_to_input, one row of predictions per environment
+		"""
+		return [self.translate_prediction_to_input(prediction) for prediction in predictions]
+
 	@abstractmethod
 	def get_action_space_size(self) -> int:
 		"""
@@ -81,13 +111,33 @@ class BaseEnvironment(ABC):
 		"""
 		pass
 
-	@abstractmethod
 	def observe(self) -> np.array:
 		"""
 		Compiles relevant state information about the simulation (probably in order to be fed as input to the neural network)
+		:returns: A new (1, input space size) float32 array
+		"""
+		observation = np.empty((1, self.get_input_space_size()), dtype=np.float32)
+		self.observe_into(observation)
+		return observation
+
+	@abstractmethod
+	def observe_into(self, buffer: np.ndarray, row: int = 0):
+		"""
+		Same as observe, written into a row of a float32 array owned by the caller instead of a new array
 		"""
 		pass
 
+	@staticmethod
+	def observe_many(envs: list['BaseEnvironment'], out: np.ndarray = None) -> np.ndarray:
+		"""
+		Observations of several environments, one row each, written into out when given (float32, (len(envs), input space size))
+		"""
+		if out is None:
+			out = np.empty((len(envs), envs[0].get_input_space_size()), dtype=np.float32)
+		for row, env in enumerate(envs):
+			env.observe_into(out, row)
+		return out
+
 	@abstractmethod
 	def random_input(self):
 		"""
@@ -130,26 +180,207 @@ class BaseEnvironment(ABC):
 		pass
 
 
+class PhysicsProfile:
+	"""
+	Accuracy / speed trade-off of a pymunk simulation :
+		iterations => Solver iterations per pymunk step
+		substeps => How many pymunk steps each physics step is split into, forces applied by process_input lasting for all of them
+		error_bias => Share of a joint's error left uncorrected after a second, given to every joint (None keeps the environment's own)
+	Training can run on fast() while showcases and evaluations run on accurate(), balanced() being what environments always used
+	"""
+
+	def __init__(self, name: str, iterations: int, substeps: int = 1, error_bias: float = None):
+		self.name = name
+		self.iterations = iterations
+		self.substeps = substeps
+		self.error_bias = error_bias
+
+	@staticmethod
+	def fast() -> 'PhysicsProfile':
+		return PhysicsProfile("fast", iterations=3)  # Trajectories barely move past a few iterations, substeps are what matters
+
+	@staticmethod
+	def balanced() -> 'PhysicsProfile':
+		return PhysicsProfile("balanced", iterations=20)
+
+	@staticmethod
+	def accurate() -> 'PhysicsProfile':
+		return PhysicsProfile("accurate", iterations=10, substeps=4)
+
+	@staticmethod
+	def get(profile) -> 'PhysicsProfile':
+		"""
+		Profile from its name, profiles being returned as they are (None gives the balanced one)
+		"""
+		if isinstance(profile, PhysicsProfile):
+			return profile
+		factories = {"fast": PhysicsProfile.fast, "balanced": PhysicsProfile.balanced, "accurate": PhysicsProfile.accurate}
+		if profile is None:
+			return PhysicsProfile.balanced()
+		if profile not in factories:
+			raise ValueError("Unknown physics profile %r (%s)" % (profile, ", ".join(factories)))
+		return factories[profile]()
+
+	def __repr__(self):
+		return "PhysicsProfile(%r, iterations=%d, substeps=%d, error_bias=%r)" % (self.name, self.iterations, self.substeps, self.error_bias)
+
+
 class PhysicsEnvironment(BaseEnvironment, ABC):
 	"""
-	Environment relying on pymunk physics
+	Environment relying on pymunk physics, simulated with a PhysicsProfile (a profile or its name)
+	Its whole state fits in a flat float64 array (see snapshot), which makes restoring, cloning and branching from any state cheap
 	"""
 
-	def __init__(self):
+	BODY_STATE_SIZE = 6  # x, y, angle, velocity x, velocity y, angular velocity
+
+	def __init__(self, physics_profile=None):
 		super().__init__()
 		self._space = pymunk.Space()
 		self._space.gravity = (0, -981)
 		self._draw_options = None
-		pymunk.pygame_util.positive_y_is_up = True
+		self._bodies = None
+		self._snapshot_tag = float(zlib.crc32(("%s.%s" % (type(self).__module__, type(self).__qualname__)).encode()))  # Tells snapshots of each class apart
+		self.reset_pool = None
+		self._error_biases = {}  # Error bias every joint was created with, for profiles which leave it alone
+		self.physics_profile = PhysicsProfile.get(physics_profile)
+		self.apply_physics_profile()
 
 	def get_space(self) -> pymunk.Space:
 		return self._space
 
+	def set_physics_profile(self, profile):
+		self.physics_profile = PhysicsProfile.get(profile)
+		self.apply_physics_profile()
+
+	def apply_physics_profile(self):
+		"""
+		Applies the profile to the space and to the joints it holds (see on_space_changed for the ones added later on)
+		Joints get back the error bias they were created with under profiles which don't set one
+		"""
+		space, profile = self.get_space(), self.physics_profile
+		space.iterations = profile.iterations
+		for constraint in space.constraints:
+			error_bias = self._error_biases.setdefault(constraint, constraint.error_bias)
+			constraint.error_bias = error_bias if profile.error_bias is None else profile.error_bias
+
+	def on_space_changed(self):
+		"""
+		To be called by subclasses once they added or removed bodies or joints, e.g. at the end of setup_environment
+		"""
+		self._bodies = None
+		self.apply_physics_profile()
+
 	def play_step(self, actions, dt: float):
 		super().play_step(actions, dt)
-		self.get_space().step(dt)
+		space, substeps = self.get_space(), self.physics_profile.substeps
+		if substeps == 1:
+			space.step(dt)
+			return
+		# pymunk clears forces after every step, those applied by process_input are set again before each substep
+		forces = [(body, body.force, body.torque) for body in space.bodies]
+		forces = [(body, force, torque) for body, force, torque in forces if force != (0, 0) or torque != 0]
+		for i in range(substeps):
+			if i > 0:
+				for body, force, torque in forces:
+					body.force, body.torque = force, torque
+			space.step(dt / substeps)
+
+	def get_bodies(self) -> list[pymunk.Body]:
+		"""
+		Dynamic bodies of the space, in the order they were added (the same for every instance of an environment)
+		The list is cached until on_space_changed, and never while the space has none (i.e. before setup_environment)
+		"""
+		if self._bodies is None:
+			bodies = [body for body in self.get_space().bodies if body.body_type == pymunk.Body.DYNAMIC]
+			if not bodies:
+				return bodies
+			self._bodies = bodies
+		return self._bodies
+
+	def _get_state_bodies(self) -> list[pymunk.Body]:
+		bodies = self.get_bodies()
+		if not bodies:
+			raise RuntimeError("%s has no bodies to snapshot or restore, set it up first (setup_environment)" % type(self).__name__)
+		return bodies
+
+	def get_extra_state(self) -> list[float]:
+		"""
+		Episode state living outside of the bodies (e.g. a target), for snapshots
+		"""
+		return []
+
+	def set_extra_state(self, values: list[float]):
+		pass
+
+	def snapshot(self) -> np.ndarray:
+		"""
+		State of the episode : a tag of the environment's class, its state (running or died), BODY_STATE_SIZE values per dynamic body, then the extra state
+		Raises a RuntimeError before the environment is set up. Joints aren't part of it : all they keep is the solver's cached impulses, which
+		pymunk doesn't expose, so rollouts from a restored state may differ from the original one by rounding errors (around 1e-11)
+		"""
+		values = [self._snapshot_tag, float(self.get_state())]
+		for body in self._get_state_bodies():
+			(x, y), (vx, vy) = body.position, body.velocity
+			values += (x, y, body.angle, vx, vy, body.angular_velocity)
+		values += self.get_extra_state()
+		return np.array(values)
+
+	def restore(self, snapshot: np.ndarray):
+		"""
+		Puts the environment back in the state of a snapshot, taken from this environment or from another instance of the same class
+		Raises a ValueError, leaving the environment untouched, for a snapshot of another class or of another size
+		"""
+		values = snapshot.tolist()  # Plain floats are way cheaper to hand over to pymunk than numpy scalars
+		bodies = self._get_state_bodies()
+		size = 2 + self.BODY_STATE_SIZE * len(bodies) + len(self.get_extra_state())
+		if values[0] != self._snapshot_tag:
+			raise ValueError("This snapshot wasn't taken from a %s" % type(self).__name__)
+		if len(values) != size:
+			raise ValueError("%s snapshots have %d values, not %d" % (type(self).__name__, size, len(values)))
+		self.set_state(int(values[1]))
+		offset = 2
+		for body in bodies:
+			x, y, angle, vx, vy, angular_velocity = values[offset:offset + self.BODY_STATE_SIZE]
+			body.position, body.angle, body.velocity, body.angular_velocity = (x, y), angle, (vx, vy), angular_velocity
+			offset += self.BODY_STATE_SIZE
+		self.set_extra_state(values[offset:])
+
+	def clone(self) -> 'PhysicsEnvironment':
+		"""
+		New instance in the same state, with the same physics profile and reset pool (its random generator isn't shared, seed it if needed)
+		"""
+		env = type(self)(self.physics_profile)
+		env.setup_environment()
+		env.restore(self.snapshot())
+		env.reset_pool = self.reset_pool
+		return env
+
+	def generate_reset_states(self, count: int) -> np.ndarray:
+		"""
+		Snapshots of `count` new episodes, drawn with reset_environment (and this environment's random generator), one per row
+		"""
+		states = np.empty((count, len(self.snapshot())))
+		for i in range(count):
+			BaseEnvironment.new_episode_case(self)
+			states[i] = self.snapshot()
+		return states
+
+	def set_reset_pool(self, states: np.ndarray = None):
+		"""
+		From then on, episodes start from one of these snapshots picked at random, rather than from reset_environment (None to go back to it)
+		The pool can be shared between any number of environments, e.g. generate_reset_states run once for all of them
+		"""
+		self.reset_pool = states
+
+	def new_episode_case(self):
+		if self.reset_pool is None:
+			super().new_episode_case()
+		else:
+			self.restore(self.reset_pool[int(self.rng.random() * len(self.reset_pool))])  # Way faster than rng.integers for a single draw
 
 	def draw(self, screen):
-		if self._draw_options is None:
+		if self._draw_options is None or self._draw_options.surface is not screen:
+			import pymunk.pygame_util  # Only imported once something gets drawn, so that headless runs never load pygame
+			pymunk.pygame_util.positive_y_is_up = True
 			self._draw_options = pymunk.pygame_util.DrawOptions(screen)
 		self.get_space().debug_draw(self._draw_options)
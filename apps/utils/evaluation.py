@@ -0,0 +1,135 @@
+import concurrent.futures
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from apps.utils import gym_utils
+from apps.utils.environment import BaseEnvironment, PhysicsEnvironment
+from apps.utils.gym_utils import seed_sequence
+from apps.utils.inference import load_policy
+from apps.utils.sweep import format_value, init_worker
+
+REPORT_COLUMNS = (
+	"checkpoint", "episodes", "return_mean", "return_std", "return_min", "return_p5", "return_p50", "return_p95", "return_max",
+	"length_mean", "failure_rate", "time_to_failure_mean", "time_to_failure_p50", "duration"
+)
+
+
+def play_episodes(envs: list[BaseEnvironment], policy, episodes: int, max_ticks: int = 0, action_repeat: int = 1) -> dict:
+	"""
+	Plays the policy greedily until `episodes` episodes are over, spread across the given environments which are all stepped
+	together, their observations going through the policy as a single batch
+	An episode ends when the agent dies, or after max_ticks physics steps (if positive) in which case it didn't fail
+	Each action is played for action_repeat physics steps, as the policy was trained with (see TrainingSettings)
+	:returns: Per episode arrays of returns, lengths (physics steps) and whether they ended by failing, in the order they were started
+	"""
+	started = min(episodes, len(envs))
+	slots = list(range(started))  # Index of the episode each environment plays
+	returns, lengths, failed = np.zeros(episodes), np.zeros(episodes, dtype=np.int64), np.zeros(episodes, dtype=bool)
+	states = np.empty((started, envs[0].get_input_space_size()), dtype=np.float32)
+	for env in envs[:started]:
+		env.setup_environment()
+		env.new_episode_case()
+
+	envs = envs[:started]
+	while envs:
+		BaseEnvironment.observe_many(envs, states[:len(envs)])
+		actions = envs[0].translate_predictions_to_inputs(policy(states[:len(envs)]))
+		i = 0
+		while i < len(envs):
+			env, episode = envs[i], slots[i]
+			reward, steps = env.play_steps(actions[i], gym_utils.TIME_STEP, action_repeat)
+			returns[episode] += reward
+			lengths[episode] += steps
+			died = env.get_state() == BaseEnvironment.STATE_DIED
+			if died or 0 < max_ticks <= lengths[episode]:
+				failed[episode] = died
+				if started < episodes:  # The environment moves on to the next episode
+					slots[i], started = started, started + 1
+					env.new_episode_case()
+				else:
+					del envs[i], slots[i]
+					actions = np.delete(actions, i, axis=0)
+					continue
+			i += 1
+	return {"returns": returns, "lengths": lengths, "failed": failed}
+
+
+def play_branches(env: PhysicsEnvironment, state: np.ndarray, action_sequences, action_repeat: int = 1) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Plays each sequence of actions from the same state (see PhysicsEnvironment.snapshot), e.g. to compare candidate plans
+	A branch stops early if the agent dies, and the environment is put back in the given state afterwards
+	:returns: The return of every branch, and how many physics steps it lasted
+	"""
+	returns, lengths = np.zeros(len(action_sequences)), np.zeros(len(action_sequences), dtype=np.int64)
+	for i, actions in enumerate(action_sequences):
+		env.restore(state)
+		for action in actions:
+			reward, steps = env.play_steps(action, gym_utils.TIME_STEP, action_repeat)
+			returns[i] += reward
+			lengths[i] += steps
+			if env.get_state() == BaseEnvironment.STATE_DIED:
+				break
+	env.restore(state)
+	return returns, lengths
+
+
+def summarize(checkpoint: str, episodes: dict) -> dict:
+	"""
+	One row of the report (REPORT_COLUMNS) out of the episodes played by play_episodes
+	Time to failure is in simulated seconds, and only covers the episodes that failed
+	"""
+	returns, lengths, failed = episodes["returns"], episodes["lengths"], episodes["failed"]
+	failures = lengths[failed] * gym_utils.TIME_STEP
+	p5, p50, p95 = np.percentile(returns, [5, 50, 95])
+	return {
+		"checkpoint": checkpoint, "episodes": len(returns),
+		"return_mean": float(returns.mean()), "return_std": float(returns.std()), "return_min": float(returns.min()),
+		"return_p5": float(p5), "return_p50": float(p50), "return_p95": float(p95), "return_max": float(returns.max()),
+		"length_mean": float(lengths.mean()), "failure_rate": float(failed.mean()),
+		"time_to_failure_mean": float(failures.mean()) if len(failures) else None,
+		"time_to_failure_p50": float(np.median(failures)) if len(failures) else None,
+	}
+
+
+def evaluate_checkpoint(env_factory, checkpoint: str, episodes: int = 100, envs: int = 32, max_ticks: int = 5000, action_repeat: int = 1, seed=None, model_factory=None) -> dict:
+	"""
+	Loads a checkpoint into a policy for env_factory's environments and plays `episodes` greedy episodes over `envs` of them
+	The checkpoint goes into model_factory(env), env.create_model() by default (see load_policy)
+	:returns: The report row (see summarize), along with the per episode arrays under "episodes_data"
+	"""
+	start = time.time()
+	instances = [env_factory() for _ in range(min(envs, episodes))]
+	if seed is not None:
+		for env, env_seed in zip(instances, seed_sequence(seed).spawn(len(instances))):
+			env.seed(env_seed)
+	played = play_episodes(instances, load_policy(instances[0], checkpoint, model_factory), episodes, max_ticks, action_repeat)
+	result = summarize(checkpoint, played)
+	result["duration"] = time.time() - start
+	result["episodes_data"] = played
+	return result
+
+
+def evaluate(env_factory, checkpoints: list[str], workers: int = None, threads_per_worker: int = 1, seed=None, **kwargs) -> list[dict]:
+	"""
+	Evaluates every checkpoint across a pool of processes, env_factory being picklable (an environment class is just fine)
+	With a seed, every checkpoint faces the very same starting conditions, which makes their comparison fairer
+	Other keyword arguments (episodes, envs, max_ticks, action_repeat, model_factory) go to evaluate_checkpoint
+	:returns: One result per checkpoint, in the same order
+	"""
+	workers = min(len(checkpoints), workers or max(1, (os.cpu_count() or 1) // threads_per_worker))
+	seed = seed_sequence(seed) if seed is not None else None
+	with concurrent.futures.ProcessPoolExecutor(workers, mp.get_context("spawn"), init_worker, (threads_per_worker,)) as pool:
+		futures = [pool.submit(evaluate_checkpoint, env_factory, checkpoint, seed=seed, **kwargs) for checkpoint in checkpoints]
+		for future in concurrent.futures.as_completed(futures):
+			result = future.result()
+			print("> %s: return %.4g (p5 %.4g), failure rate %.2f" % (result["checkpoint"], result["return_mean"], result["return_p5"], result["failure_rate"]))
+		return [future.result() for future in futures]
+
+
+def format_report(results: list[dict]) -> str:
+	rows = [list(REPORT_COLUMNS)] + [[format_value(result.get(column)) for column in REPORT_COLUMNS] for result in results]
+	widths = [max(len(row[i]) for row in rows) for i in range(len(REPORT_COLUMNS))]
+	return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
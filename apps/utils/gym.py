@@ -1,11 +1,15 @@
 import pathlib
-
-import tensorflow as tf
+from typing import TYPE_CHECKING
 
 from apps.utils import gym_utils
+from apps.utils.checkpoint import Checkpointer
 from apps.utils.environment import BaseEnvironment
 from apps.utils.gym_utils import *
-from apps.utils.learning_modes import LearningMode
+from apps.utils.metrics import MetricsWriter
+from apps.utils.profiling import Profiler
+
+if TYPE_CHECKING:  # Learning modes bring tensorflow along, which isn't needed until one gets created
+    from apps.utils.learning_modes import LearningMode
 
 
 class BaseGym:
@@ -15,15 +19,24 @@ class BaseGym:
     RESULT_EPISODE_TIMED_OUT = 2  # Episode was terminated due to time out
     RESULT_GYM_STOPPED = 3  # Gym training has finished
 
-    def __init__(self, env: BaseEnvironment, mode: LearningMode, settings: TrainingSettings, weights: str = None, **kwargs):
+    def __init__(self, env: BaseEnvironment, mode: 'LearningMode', settings: TrainingSettings, weights: str = None, **kwargs):
         self.env = env
         self.mode = mode
         self.settings = settings
         self.epsilon = self.settings.epsilon
         self.episode_stats, self.gym_stats = StatisticsContainer(env.get_environment_name()), GymStatistics(env.get_environment_name())
+        self.profiler = kwargs.get('profiler') or Profiler()
+        self.mode.profiler = self.profiler
+        self.mode.action_repeat = settings.action_repeat
+        self.checkpointer = self._checkpointer() if settings.save_model_interval > 0 else None
+        self.metrics = MetricsWriter(settings.metrics_path) if settings.metrics_path is not None else None
         self.initialized = False
 
-        if weights is not None:
+        if kwargs.get('seed') is not None:
+            self.seed(kwargs['seed'])
+        if kwargs.get('resume') is not None:
+            self.resume(kwargs['resume'])
+        elif weights is not None:
             self.mode.load(weights)
         if kwargs.get('summary', True):
             self.mode.get_model().summary()
@@ -33,6 +46,33 @@ class BaseGym:
     def get_env(self) -> BaseEnvironment:
         return self.env
 
+    def get_envs(self) -> list[BaseEnvironment]:
+        return [self.env]
+
+    def seed(self, seed):
+        """
+        Seeds every source of randomness of the session (environment resets and random inputs, epsilon, replay sampling,
+        weights initialization) from its own stream, so that two gyms given the same seed play the exact same episodes
+        """
+        environments_seed, epsilon_seed, mode_seed = seed_sequence(seed).spawn(3)
+        self.seed_environments(environments_seed)
+        self.epsilon.seed(epsilon_seed)
+        self.mode.seed(mode_seed)
+
+    def seed_environments(self, seed: np.random.SeedSequence):
+        self.env.seed(seed)
+
+    def _checkpointer(self) -> Checkpointer:
+        return Checkpointer(self.mode, self.epsilon, self.gym_stats, self.settings.keep_checkpoints, self.settings.save_replay, envs=self.get_envs())
+
+    def resume(self, path: str):
+        """
+        Picks a training session back up from one of its checkpoints : weights, target network, optimizer, replay memory,
+        epsilon and statistics. Episodes which were running at the time are started over
+        """
+        extra = (self.checkpointer or self._checkpointer()).restore(path)
+        print("> Resumed from %s (episode %d, %d ticks)" % (path, extra.get('episode', self.gym_stats.episode_count), self.gym_stats.ticks_count))
+
     def observing(self) -> bool:
         return self.gym_stats.ticks_count < self.settings.observe
 
@@ -48,20 +88,63 @@ class BaseGym:
         self.initialized = True
 
     def next_episode(self):
+        self.end_episode(self.env, self.episode_stats)
+
+    def end_episode(self, env: BaseEnvironment, episode_stats: StatisticsContainer, env_index: int = 0):
+        """
+        Wraps up the episode played in the given environment and starts a new one there
+        """
         eps_id = self.gym_stats.episode_count + 1
+        self.record_phase_times()
+
         if eps_id % 10 == 1:
-            print(self.settings.episode_end_header(eps_id) + " " + str(self.episode_stats))
-        if self.settings.should_save_model(eps_id):
-            path = self.settings.get_save_path(eps_id)
-            self.mode.save(path)
-            print("> Model saved to " + str(pathlib.Path(path).absolute()))
+            print(self.settings.episode_end_header(eps_id) + " " + str(episode_stats))
+        if self.profiler.should_report(eps_id):
+            print("> Episode %d phases:\n%s" % (eps_id, Profiler.format_report(episode_stats.phase_times)))
+            print("> Run phases:\n%s" % Profiler.format_report(self.gym_stats.phase_times))
 
         if not self.observing():
-            self.gym_stats.on_episode_ends(self.episode_stats)
+            self.gym_stats.on_episode_ends(episode_stats)
             self.epsilon.decay()
+        if self.metrics is not None:
+            self.metrics.log(
+                episode=eps_id, ticks=episode_stats.ticks_count, simulated_time=episode_stats.get_simulated_duration(), real_duration=episode_stats.get_real_duration(),
+                total_reward=episode_stats.get_final_reward(), average_reward=episode_stats.get_average_reward(), epsilon=self.epsilon.epsilon, reward_ewma=self.gym_stats.rewards.ewma
+            )
+        if self.settings.should_save_model(eps_id):
+            path = self.settings.get_save_path(eps_id)
+            self.checkpointer.save(path, episode=eps_id, ticks=self.gym_stats.ticks_count)
+            print("> Saving model to " + str(pathlib.Path(path).absolute()))
 
-        self.episode_stats.reset()
-        self.env.new_episode_case()
+        episode_stats.reset()
+        self.mode.on_episode_ends(env_index)
+        env.new_episode_case()
+
+    def record_phase_times(self):
+        """
+        Hands what the profiler timed over to the statistics : all of it since the previous episode end belongs to the episode ending now
+        """
+        phase_times = self.profiler.flush()
+        self.episode_stats.add_phase_times(phase_times)
+        self.gym_stats.add_phase_times(phase_times)
+
+    def flush(self):
+        """
+        Waits for pending checkpoints and metrics to be written
+        """
+        if self.checkpointer is not None:
+            self.checkpointer.flush()
+        if self.metrics is not None:
+            self.metrics.flush()
+
+    def close(self):
+        """
+        Writes what's pending and stops the background writers, done by step() once the gym is complete
+        """
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        if self.metrics is not None:
+            self.metrics.close()
 
     def get_action(self, state):
         if self.epsilon.decide_greedy():  # Epsilon-greedy policy is here but might be more appropriate as a separate Mode abstract class
@@ -79,12 +162,13 @@ class BaseGym:
         ends = self.mode.step()
         ends |= self.settings.is_timed_out(self.episode_stats.ticks_count)
 
-        self.episode_stats.tick(gym_utils.TIME_STEP)
-        self.gym_stats.tick(gym_utils.TIME_STEP)
-        self.episode_stats.reward_history.append(self.env.compute_reward())
+        self.episode_stats.tick(gym_utils.TIME_STEP * self.mode.last_steps)
+        self.gym_stats.tick(gym_utils.TIME_STEP * self.mode.last_steps)
+        self.episode_stats.add_reward(self.mode.last_reward)
 
         if not self.observing() and (self.settings.train_after == self.settings.TRAIN_AFTER_TIME_STEPS or ends) and self.settings.should_train(self.gym_stats, self.episode_stats):
-            self.mode.train()
+            with self.profiler.section("train"):
+                self.mode.train()
 
         if self.gym_stats.ticks_count == self.settings.observe:
             print("Observation done. Starting training.")
@@ -93,6 +177,7 @@ class BaseGym:
 
     def get_return_code(self) -> int:
         if self.settings.is_gym_complete(self.gym_stats.episode_count, self.gym_stats.get_real_duration()):
+            self.close()
             return BaseGym.RESULT_GYM_STOPPED
 
         if self.settings.is_timed_out(self.episode_stats.ticks_count):
@@ -102,3 +187,83 @@ class BaseGym:
             return BaseGym.RESULT_EPISODE_TERMINATED
 
         return BaseGym.RESULT_NOTHING_NEW
+
+
+class VectorGym(BaseGym):
+    """
+    Gym running several independent environments side by side
+    Their observations are stacked so that each step only needs a single model call, whatever the number of environments
+    The learning mode should be built around the first environment, as it's used for anything environment-wide (model creation, input size, ...)
+    """
+
+    def __init__(self, envs: list[BaseEnvironment], mode: 'LearningMode', settings: TrainingSettings, weights: str = None, **kwargs):
+        self.envs = envs
+        self.envs_stats = [StatisticsContainer(env.get_environment_name()) for env in envs]
+        super().__init__(envs[0], mode, settings, weights, **kwargs)
+        self.episode_stats = self.envs_stats[0]
+
+    def get_envs(self) -> list[BaseEnvironment]:
+        return self.envs
+
+    def seed_environments(self, seed: np.random.SeedSequence):
+        for env, env_seed in zip(self.envs, seed.spawn(len(self.envs))):
+            env.seed(env_seed)
+
+    def _init(self):
+        for env in self.envs:
+            env.setup_environment()
+            env.new_episode_case()
+        self.initialized = True
+
+    def step(self):
+        """
+        Performs one step in every environment, those which ended their episode being reset individually beforehand
+        Unlike BaseGym, exploration happens here through the gym's epsilon
+        """
+        for i, (env, stats) in enumerate(zip(self.envs, self.envs_stats)):
+            if self.settings.is_timed_out(stats.ticks_count) or env.get_state() == BaseEnvironment.STATE_DIED:
+                self.end_episode(env, stats, i)
+
+        rewards, ends = self.mode.step_many(self.envs, self.epsilon)
+
+        # Transitions are accounted for one by one, so that training keeps the same pace as with a single environment
+        for stats, reward, env_ends, steps in zip(self.envs_stats, rewards, ends, self.mode.last_steps):
+            env_ends |= self.settings.is_timed_out(stats.ticks_count)
+
+            stats.tick(gym_utils.TIME_STEP * steps)
+            self.gym_stats.tick(gym_utils.TIME_STEP * steps)
+            stats.add_reward(reward)
+
+            if not self.observing() and (self.settings.train_after == self.settings.TRAIN_AFTER_TIME_STEPS or env_ends) and self.settings.should_train(self.gym_stats, stats):
+                with self.profiler.section("train"):
+                    self.mode.train()
+
+            if self.gym_stats.ticks_count == self.settings.observe:
+                print("Observation done. Starting training.")
+
+        if self.profiler.enabled:
+            self.record_phase_times()
+        return self.get_return_code()
+
+    def record_phase_times(self):
+        """
+        Environments are stepped together, so every step's phases are shared evenly between them (done after every step)
+        """
+        phase_times = self.profiler.flush()
+        share = {name: (total / len(self.envs), count / len(self.envs)) for name, (total, count) in phase_times.items()}
+        for stats in self.envs_stats:
+            stats.add_phase_times(share)
+        self.gym_stats.add_phase_times(phase_times)
+
+    def get_return_code(self) -> int:
+        if self.settings.is_gym_complete(self.gym_stats.episode_count, self.gym_stats.get_real_duration()):
+            self.close()
+            return BaseGym.RESULT_GYM_STOPPED
+
+        if any(env.get_state() == BaseEnvironment.STATE_DIED for env in self.envs):
+            return BaseGym.RESULT_EPISODE_TERMINATED
+
+        if any(self.settings.is_timed_out(stats.ticks_count) for stats in self.envs_stats):
+            return BaseGym.RESULT_EPISODE_TIMED_OUT
+
+        return BaseGym.RESULT_NOTHING_NEW
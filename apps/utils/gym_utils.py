@@ -1,33 +1,321 @@
 import time
-import random
-from collections import deque
 
 import numpy as np
 
 TIME_STEP = 0.02
 
 
+def seed_sequence(seed) -> np.random.SeedSequence:
+    """
+    Seeds can either be given as ints or as SeedSequences, which spawn independent streams for every component that needs one
+    """
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
 class ReplayBuffer:
+    """
+    Fixed-size replay memory storing transitions column by column in preallocated numpy arrays
+    Once full, the oldest transitions get overwritten (ring buffer), and sampling is a vectorized gather over random indices
+    The state size can be given upfront (e.g. env.get_input_space_size()), otherwise it is inferred from the first transition
+    """
 
-    def __init__(self, memory_size: int, batch_size: int = -1):
-        self.replays = deque(maxlen=memory_size)
+    def __init__(self, memory_size: int, batch_size: int = -1, state_size: int = None):
+        self.memory_size = memory_size
         self.batch_size = batch_size
+        self.state_size = None
+        self.position = 0  # Next slot to be written
+        self.count = 0  # How many slots hold a transition
+        self.states = self.actions = self.rewards = self.next_states = self.ends = None
+        self.rng = np.random.default_rng()
+        if state_size is not None:
+            self._allocate(state_size)
+
+    def _allocate(self, state_size: int):
+        self.state_size = state_size
+        self.states = np.zeros((self.memory_size, state_size), dtype=np.float32)
+        self.actions = np.zeros(self.memory_size, dtype=np.int32)
+        self.rewards = np.zeros(self.memory_size, dtype=np.float32)
+        self.next_states = np.zeros((self.memory_size, state_size), dtype=np.float32)
+        self.ends = np.zeros(self.memory_size, dtype=np.float32)
+
+    def __len__(self):
+        return self.count
 
     def remember(self, state, action, reward, next_state, ends):
-        self.replays.append((state, action, reward, next_state, ends))
-
-    def sample(self, size: int = -1):
+        if self.state_size is None:
+            self._allocate(np.size(state))
+        i = self.position
+        self.states[i] = np.reshape(state, self.state_size)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = np.reshape(next_state, self.state_size)
+        self.ends[i] = ends
+        self.position = (i + 1) % self.memory_size
+        self.count = min(self.count + 1, self.memory_size)
+
+    def remember_batch(self, states, actions, rewards, next_states, ends):
+        """
+        Stores several transitions at once (one row per transition)
+        """
+        count = len(actions)
+        states, next_states = np.reshape(states, (count, -1)), np.reshape(next_states, (count, -1))
+        if self.state_size is None:
+            self._allocate(states.shape[1])
+        if count > self.memory_size:  # Only the most recent transitions would survive anyway
+            keep = slice(count - self.memory_size, count)
+            states, actions, rewards, next_states, ends = states[keep], actions[keep], rewards[keep], next_states[keep], ends[keep]
+            count = self.memory_size
+        indices = (self.position + np.arange(count)) % self.memory_size
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = next_states
+        self.ends[indices] = ends
+        self.position = (self.position + count) % self.memory_size
+        self.count = min(self.count + count, self.memory_size)
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def sample_indices(self, size: int = -1):
+        """
+        Picks random slots to be trained on (with replacement, which is unnoticeable for large memories but keeps sampling O(size))
+        """
         if size < 0:
             size = self.batch_size
-        if size < 0 or len(self.replays) < size:
+        if size < 0 or self.count < size:
+            return None
+        return self.rng.integers(0, self.count, size)
+
+    def gather(self, indices):
+        return self.states[indices], self.actions[indices], self.rewards[indices], self.next_states[indices], self.ends[indices]
+
+    def sample(self, size: int = -1):
+        indices = self.sample_indices(size)
+        if indices is None:
             return None
-        return random.sample(self.replays, size)
+        return self.gather(indices)
 
     def np_sample(self, size: int = -1):
-        s = self.sample(size)
-        if s is None:
+        return self.sample(size)
+
+    def snapshot(self) -> dict:
+        """
+        Copy of the memory's content (filled slots only) and write position, to be saved and restored later on
+        """
+        if self.state_size is None:
+            return {"position": 0, "count": 0, "rng": self.rng.bit_generator.state}
+        filled = slice(0, self.count)
+        return {
+            "states": self.states[filled].copy(), "actions": self.actions[filled].copy(), "rewards": self.rewards[filled].copy(),
+            "next_states": self.next_states[filled].copy(), "ends": self.ends[filled].copy(),
+            "position": self.position, "count": self.count, "rng": self.rng.bit_generator.state
+        }
+
+    def restore(self, snapshot: dict):
+        """
+        Loads a snapshot back. A full memory's arrays are used as they are rather than copied, so that memory-mapped ones
+        (np.load with mmap_mode='c') are only read from the disk as they get sampled
+        """
+        count = int(snapshot["count"])
+        if count > self.memory_size:
+            raise ValueError("Can't restore %d transitions into a memory of size %d" % (count, self.memory_size))
+        if count == self.memory_size:
+            self.states, self.actions, self.rewards = snapshot["states"], snapshot["actions"], snapshot["rewards"]
+            self.next_states, self.ends = snapshot["next_states"], snapshot["ends"]
+            self.state_size = self.states.shape[1]
+        elif count > 0:
+            if self.state_size is None:
+                self._allocate(snapshot["states"].shape[1])
+            filled = slice(0, count)
+            self.states[filled], self.actions[filled], self.rewards[filled] = snapshot["states"], snapshot["actions"], snapshot["rewards"]
+            self.next_states[filled], self.ends[filled] = snapshot["next_states"], snapshot["ends"]
+        self.position = int(snapshot["position"]) % self.memory_size
+        self.count = count
+        if "rng" in snapshot:
+            self.rng.bit_generator.state = snapshot["rng"]
+
+
+class SumTree:
+    """
+    Array-backed binary tree where each parent holds the sum of its children's priorities
+    Leaves are stored at [capacity; 2 * capacity[ (capacity being rounded up to a power of two), the root at index 1
+    """
+
+    def __init__(self, size: int):
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self) -> float:
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.capacity]
+
+    def update(self, indices, priorities):
+        """
+        Sets the priorities of several leaves at once, then refreshes their ancestors level by level (O(log n) numpy operations)
+        """
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] > 0:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """
+        Finds the leaves where the given cumulative priority values fall (one descent per value, all performed together)
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            go_right = values >= self.tree[left]
+            values -= np.where(go_right, self.tree[left], 0)
+            nodes = left + go_right
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Replay memory sampling transitions proportionally to their priority (|TD error| + e) ^ alpha
+    Sampled indices and their importance-sampling weights are kept in last_indices and last_weights until update_priorities is called
+    beta is annealed towards 1 by beta_increment on every sample
+    """
+
+    def __init__(self, memory_size: int, batch_size: int = -1, state_size: int = None, alpha: float = 0.6, beta: float = 0.4, beta_increment: float = 0.0001, e: float = 0.01):
+        super().__init__(memory_size, batch_size, state_size)
+        self.tree = SumTree(memory_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.e = e
+        self.max_priority = 1.
+        self.last_indices = None
+        self.last_weights = None
+
+    def remember(self, state, action, reward, next_state, ends):
+        i = self.position
+        super().remember(state, action, reward, next_state, ends)
+        self.tree.update([i], self.max_priority)  # New transitions are trained on at least once
+
+    def remember_batch(self, states, actions, rewards, next_states, ends):
+        count = min(len(actions), self.memory_size)
+        indices = (self.position + np.arange(count)) % self.memory_size
+        super().remember_batch(states, actions, rewards, next_states, ends)
+        self.tree.update(indices, self.max_priority)
+
+    def sample_indices(self, size: int = -1):
+        if size < 0:
+            size = self.batch_size
+        if size < 0 or self.count < size:
             return None
-        return map(lambda x: np.array(x), zip(*self.sample(size)))
+
+        # Stratified sampling: one value picked in each of the `size` equal segments of the total priority
+        total = self.tree.total()
+        values = (np.arange(size) + self.rng.random(size)) * (total / size)
+        indices = np.minimum(self.tree.find(values), self.count - 1)
+
+        probabilities = self.tree.get(indices) / total
+        weights = (self.count * probabilities) ** -self.beta
+        self.beta = min(1., self.beta + self.beta_increment)
+
+        self.last_indices = indices
+        self.last_weights = (weights / weights.max()).astype(np.float32)
+        return indices
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["priorities"] = self.tree.get(np.arange(self.count))
+        snapshot["max_priority"], snapshot["beta"] = self.max_priority, self.beta
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        super().restore(snapshot)
+        self.tree = SumTree(self.memory_size)
+        self.tree.update(np.arange(self.count), snapshot["priorities"])
+        self.max_priority, self.beta = float(snapshot["max_priority"]), float(snapshot["beta"])
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.e) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities)
+
+
+class NStepAccumulator:
+    """
+    Sits between environments and a replay memory, turning their 1-step transitions into n-step ones :
+    (s_t, a_t, r_t + gamma * r_t+1 + ... + gamma^(n-1) * r_t+n-1, s_t+n), to be bootstrapped with gamma^n
+    Each environment has a ring of its last n steps, all of them being processed at once by push()
+    When an environment dies, its pending steps are flushed as shorter terminal transitions (nothing to bootstrap from anyway)
+    Steps pending when an episode is cut short otherwise (time out) are dropped by discard(), as their bootstrap state isn't
+    n steps away
+    """
+
+    def __init__(self, n: int, gamma: float):
+        self.n = n
+        self.gamma = gamma
+        self.envs = 0
+
+    def _allocate(self, envs: int, state_size: int):
+        self.envs = envs
+        self.states = np.zeros((envs, self.n, state_size), dtype=np.float32)
+        self.actions = np.zeros((envs, self.n), dtype=np.int32)
+        self.rewards = np.zeros((envs, self.n), dtype=np.float32)
+        self.start = np.zeros(envs, dtype=np.int64)  # Ring slot of the oldest pending step of each environment
+        self.count = np.zeros(envs, dtype=np.int64)  # Pending steps of each environment
+
+    def push(self, memory: ReplayBuffer, states, actions, rewards, next_states, ends):
+        """
+        Adds one step per environment (one row each), and stores the transitions this completes into the memory
+        """
+        envs = len(actions)
+        states, next_states = np.reshape(states, (envs, -1)), np.reshape(next_states, (envs, -1))
+        if self.envs != envs:
+            self._allocate(envs, states.shape[1])
+        rows = np.arange(envs)
+        slots = (self.start + self.count) % self.n
+        self.states[rows, slots], self.actions[rows, slots], self.rewards[rows, slots] = states, actions, rewards
+        self.count += 1
+
+        # Pending steps from the oldest to the newest, and the discounted return from each of them to the newest
+        order = (self.start[:, None] + np.arange(self.n)) % self.n
+        pending = np.arange(self.n) < self.count[:, None]
+        rewards = np.where(pending, np.take_along_axis(self.rewards, order, axis=1), 0)
+        returns = np.empty_like(rewards)
+        returns[:, -1] = rewards[:, -1]
+        for k in range(self.n - 2, -1, -1):
+            returns[:, k] = rewards[:, k] + self.gamma * returns[:, k + 1]
+
+        ends = np.asarray(ends, dtype=bool)
+        full = (self.count == self.n) & ~ends  # Emits its oldest step
+        flushed = pending & ends[:, None]  # Emits every pending step
+        emitted = np.zeros_like(pending)
+        emitted[:, 0] = full
+        emitted |= flushed
+        if emitted.any():
+            memory.remember_batch(
+                self.states[rows[:, None], order][emitted],
+                np.take_along_axis(self.actions, order, axis=1)[emitted],
+                returns[emitted],
+                np.broadcast_to(next_states[:, None], (envs, self.n, next_states.shape[1]))[emitted],
+                np.broadcast_to(ends[:, None], (envs, self.n))[emitted].astype(np.float32)
+            )
+
+        self.start[full] = (self.start[full] + 1) % self.n
+        self.count[full] -= 1
+        self.discard(ends)
+
+    def discard(self, indices=slice(None)):
+        """
+        Drops the pending steps of the given environments (all of them by default)
+        """
+        if self.envs > 0:
+            self.start[indices] = 0
+            self.count[indices] = 0
 
 
 class Epsilon:
@@ -56,6 +344,10 @@ class Epsilon:
         self.end_value = end_value
         self.decay_rate = decay_rate
         self.epsilon = start_value
+        self.rng = np.random.default_rng()
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
 
     def get(self) -> float:
         return self.epsilon
@@ -65,11 +357,60 @@ class Epsilon:
             self.epsilon *= self.decay_rate
 
     def decide_greedy(self) -> bool:
-        return random.random() < self.epsilon
+        return self.rng.random() < self.epsilon
 
     def reset(self):
         self.epsilon = self.start_value
 
+    def snapshot(self) -> dict:
+        return {"epsilon": self.epsilon, "rng": self.rng.bit_generator.state}
+
+    def restore(self, snapshot: dict):
+        self.epsilon = float(snapshot["epsilon"])
+        if "rng" in snapshot:
+            self.rng.bit_generator.state = snapshot["rng"]
+
+
+class RunningStats:
+    """
+    Aggregates of a stream of values (count, sum, mean, exponentially weighted mean, min, max, last), updated in O(1)
+    without keeping the values themselves around
+    """
+
+    def __init__(self, ewma_alpha: float = 0.05):
+        self.ewma_alpha = ewma_alpha
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.
+        self.ewma = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.last = 0.
+
+    def add(self, value: float):
+        value = float(value)
+        self.ewma = value if self.count == 0 else self.ewma + self.ewma_alpha * (value - self.ewma)
+        self.count += 1
+        self.total += value
+        self.last = value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "total": self.total, "ewma": self.ewma, "min": self.min, "max": self.max, "last": self.last}
+
+    def restore(self, snapshot: dict):
+        self.count, self.total, self.ewma = int(snapshot["count"]), float(snapshot["total"]), float(snapshot["ewma"])
+        self.min, self.max, self.last = float(snapshot["min"]), float(snapshot["max"]), float(snapshot["last"])
+
 
 class StatisticsContainer:
 
@@ -78,18 +419,39 @@ class StatisticsContainer:
         self.simulated_time = 0
         self.ticks_count = 0
         self.real_start_time = time.time()
-        self.reward_history = []
+        self.rewards = RunningStats()
         self.last_action = None
+        self.phase_times = {}  # Phase name => (total seconds, calls) as measured by the gym's profiler, over the episode (the run for GymStatistics)
 
-    def tick(self, dt: float):
-        self.simulated_time += dt
-        self.ticks_count += 1
+    def tick(self, dt: float, ticks: int = 1):
+        self.simulated_time += dt * ticks
+        self.ticks_count += ticks
 
     def reset(self):
         self.simulated_time = 0
         self.ticks_count = 0
         self.real_start_time = time.time()
-        self.reward_history.clear()
+        self.rewards.reset()
+        self.phase_times = {}
+
+    def snapshot(self) -> dict:
+        return {
+            "simulated_time": self.simulated_time, "ticks_count": self.ticks_count, "real_duration": self.get_real_duration(),
+            "rewards": self.rewards.snapshot()
+        }
+
+    def restore(self, snapshot: dict):
+        self.simulated_time, self.ticks_count = float(snapshot["simulated_time"]), int(snapshot["ticks_count"])
+        self.real_start_time = time.time() - float(snapshot["real_duration"])
+        self.rewards.restore(snapshot["rewards"])
+
+    def add_reward(self, reward: float):
+        self.rewards.add(reward)
+
+    def add_phase_times(self, phase_times: dict):
+        for name, (total, count) in phase_times.items():
+            previous_total, previous_count = self.phase_times.get(name, (0., 0))
+            self.phase_times[name] = previous_total + total, previous_count + count
 
     def get_ticks_count(self) -> int:
         return self.ticks_count
@@ -101,12 +463,10 @@ class StatisticsContainer:
         return self.simulated_time
 
     def get_average_reward(self):
-        if len(self.reward_history) == 0:
-            return 0
-        return sum(self.reward_history) / len(self.reward_history)
+        return self.rewards.mean
 
     def get_final_reward(self):
-        return sum(self.reward_history)
+        return self.rewards.total
 
     def get_last_action(self):
         return self.last_action
@@ -131,8 +491,22 @@ class GymStatistics(StatisticsContainer):
         return self.episode_count
 
     def on_episode_ends(self, stats: StatisticsContainer):
+        self.add_episode(stats.get_final_reward())
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["episode_count"] = self.episode_count
+        snapshot["phase_times"] = dict(self.phase_times)
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        super().restore(snapshot)
+        self.episode_count = int(snapshot["episode_count"])
+        self.phase_times = {name: tuple(times) for name, times in snapshot.get("phase_times", {}).items()}
+
+    def add_episode(self, final_reward: float):
         self.episode_count += 1
-        self.reward_history.append(stats.get_final_reward())
+        self.rewards.add(final_reward)
 
 
 class TrainingSettings:
@@ -142,11 +516,15 @@ class TrainingSettings:
 
         episodes => Max number of episodes to run during the session
         episode_time => Time after witch an episode is forcefully terminated (It could be a good or bad thing, depending on the context)
+        action_repeat => How many physics steps each action is played for (frame skip). Ticks (episode_time, observe, ...) count the agent's decisions, the simulated time every physics step
         max_real_duration => How much time to allocate to this particular training session (terminate the gym session on overshoot)
         observe => How many time steps are performed before starting the training process (Observation phase)
         epsilon => Settings for the epsilon greedy method. Epsilon.none() is the default
         save_interval => After how many episodes to save the current model as a file
         save_path => Where to save the model ({eps} will be replaced by the current episode id, e.g. eps_{eps}.h5)
+        keep_checkpoints => How many of the last saved models to keep on disk, older ones being deleted (0 to keep them all)
+        save_replay => Whether the replay memory is saved along with the model, so that training can be resumed from there
+        metrics_path => Where to log the statistics of every episode (.csv or .npy, see MetricsWriter), None not to log them
     """
 
     TRAIN_AFTER_TIME_STEPS = 0
@@ -155,11 +533,15 @@ class TrainingSettings:
     def __init__(self, **kwargs):
         self.episodes = kwargs.get('episodes', 0)
         self.episode_time = kwargs.get('episode_time', 0)
+        self.action_repeat = kwargs.get('action_repeat', 1)
         self.max_real_duration = kwargs.get('max_real_duration', 0)
         self.observe = kwargs.get('observe', 0)
         self.epsilon = kwargs.get('epsilon', Epsilon.none())
         self.save_model_interval = kwargs.get('save_interval', 25)
         self.save_model_path = kwargs.get('save_path', "models/eps_{eps}.h5")
+        self.keep_checkpoints = kwargs.get('keep_checkpoints', 0)
+        self.save_replay = kwargs.get('save_replay', True)
+        self.metrics_path = kwargs.get('metrics_path', None)
         self.train_after = kwargs.get('train_after', self.TRAIN_AFTER_TIME_STEPS)
         self.train_policy = kwargs.get('train_policy', lambda gym_stats, episode_stats: gym_stats.get_ticks_count() % 10 == 0)
 
@@ -0,0 +1,87 @@
+import os
+
+from apps.utils import gym_utils
+from apps.utils.environment import BaseEnvironment
+from apps.utils.gym_utils import Epsilon, StatisticsContainer
+
+
+class HeadlessRunner:
+	"""
+	Plays a policy (a keras model, a NumpyPolicy or anything predicting from observations) without any window, as fast as it can
+	Unlike SimplePygameDebugEnvironment, nothing is tied to a frame rate : frames are only drawn every render_every steps (never with 0),
+	onto an off-screen surface, then written as PNG files to frames_dir and/or encoded into video_path (needs the imageio package)
+	pygame is only imported when something has to be rendered
+	Each action is played for action_repeat physics steps, as the policy was trained with (see TrainingSettings)
+	"""
+
+	def __init__(self, env: BaseEnvironment, policy, epsilon: Epsilon = None, render_every: int = 0, frames_dir: str = None, video_path: str = None, fps: int = 50, action_repeat: int = 1):
+		self.env = env
+		self.policy = policy
+		self.epsilon = epsilon or Epsilon.none()
+		self.action_repeat = action_repeat
+		self.render_every = render_every
+		self.frames_dir = frames_dir
+		self.video_path = video_path
+		self.fps = fps
+		self.surface = None
+		self.video_writer = None
+		self.frame_count = 0
+
+	def read_input(self):
+		if self.epsilon.decide_greedy():
+			return self.env.random_input()
+		return self.env.translate_prediction_to_input(self.policy(self.env.observe()))
+
+	def _open_outputs(self):
+		import pygame
+		self.surface = pygame.Surface(self.env.get_environment_size())
+		if self.frames_dir is not None:
+			os.makedirs(self.frames_dir, exist_ok=True)
+		if self.video_path is not None:
+			try:
+				import imageio.v2 as imageio
+			except ImportError:
+				raise ImportError("Writing videos requires imageio (and imageio-ffmpeg for mp4 files): pip install imageio imageio-ffmpeg")
+			self.video_writer = imageio.get_writer(self.video_path, fps=self.fps)
+
+	def render(self):
+		import pygame
+		if self.surface is None:
+			self._open_outputs()
+
+		self.surface.fill((255, 255, 255))
+		self.env.draw(self.surface)
+		if self.frames_dir is not None:
+			pygame.image.save(self.surface, os.path.join(self.frames_dir, "frame_%06d.png" % self.frame_count))
+		if self.video_writer is not None:
+			self.video_writer.append_data(pygame.surfarray.array3d(self.surface).swapaxes(0, 1))
+		self.frame_count += 1
+
+	def run(self, episodes: int = 1, max_ticks: int = 0) -> list[StatisticsContainer]:
+		"""
+		Plays the given number of episodes, each of them ending when the agent dies or after max_ticks steps (if positive)
+		:returns: The statistics of every episode
+		"""
+		self.env.setup_environment()
+		results = []
+		try:
+			for _ in range(episodes):
+				stats = StatisticsContainer(self.env.get_environment_name())
+				self.env.new_episode_case()
+				while self.env.get_state() != BaseEnvironment.STATE_DIED and not (0 < max_ticks <= stats.ticks_count):
+					reward, steps = self.env.play_steps(self.read_input(), gym_utils.TIME_STEP, self.action_repeat)
+					stats.tick(gym_utils.TIME_STEP * steps)
+					stats.add_reward(reward)
+					if self.render_every > 0 and stats.ticks_count % self.render_every == 0:
+						self.render()
+				self.epsilon.decay()
+				results.append(stats)
+				print(stats)
+		finally:
+			self.close()
+		return results
+
+	def close(self):
+		if self.video_writer is not None:
+			self.video_writer.close()
+			self.video_writer = None
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+def _linear(x):
+	return x
+
+
+def _relu(x):
+	return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x):
+	return 1 / (1 + np.exp(-x))
+
+
+def _softmax(x):
+	e = np.exp(x - x.max(axis=-1, keepdims=True))
+	return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+	'linear': _linear,
+	'relu': _relu,
+	'tanh': np.tanh,
+	'sigmoid': _sigmoid,
+	'softmax': _softmax,
+}
+
+
+class NumpyPolicy:
+	"""
+	Frozen snapshot of a Sequential stack of Dense layers (like the models from create_model), evaluated with plain numpy
+	For a handful of small layers, the framework's dispatch costs way more than the maths, which this gets rid of
+	Calling it works like calling the model, except that it returns a numpy array
+	"""
+
+	def __init__(self, kernels: list[np.ndarray], biases: list[np.ndarray], activations: list[str]):
+		self.kernels = kernels
+		self.biases = biases
+		self.activations = [ACTIVATIONS[name] for name in activations]
+		self.activation_names = activations
+
+	@staticmethod
+	def from_keras(model) -> 'NumpyPolicy':
+		"""
+		Reads the layers of a keras model, which must only be made of Dense layers with a supported activation
+		"""
+		activations = []
+		for layer in model.layers:
+			config = layer.get_config()
+			if type(layer).__name__ != 'Dense' or not config.get('use_bias', False) or config.get('activation') not in ACTIVATIONS:
+				raise ValueError("Can't export layer %s (%s) to numpy" % (layer.name, type(layer).__name__))
+			activations.append(config['activation'])
+
+		policy = NumpyPolicy([], [], activations)
+		policy.refresh(model)
+		return policy
+
+	def get_weights(self) -> list[np.ndarray]:
+		"""
+		Weights in the same order as keras' get_weights (kernel, bias, kernel, bias, ...)
+		"""
+		return [w for layer in zip(self.kernels, self.biases) for w in layer]
+
+	def set_weights(self, weights: list[np.ndarray]):
+		self.kernels = [np.asarray(w, dtype=np.float32) for w in weights[0::2]]
+		self.biases = [np.asarray(w, dtype=np.float32) for w in weights[1::2]]
+
+	def refresh(self, model):
+		"""
+		Takes a new snapshot of the model's weights (e.g. after it got trained)
+		"""
+		self.set_weights(model.get_weights())
+
+	def __call__(self, states) -> np.ndarray:
+		x = np.asarray(states, dtype=np.float32)
+		for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+			x = activation(x @ kernel + bias)
+		return x
+
+
+def load_policy(env, weights: str, model_factory=None):
+	"""
+	Model from model_factory(env) with the given weights, turned into a NumpyPolicy when it can be (the keras model otherwise)
+	model_factory defaults to env.create_model(), checkpoints of a learning mode with its own network need theirs,
+	e.g. apps.utils.models.create_env_dueling_model for DuelingDQN
+	"""
+	model = env.create_model() if model_factory is None else model_factory(env)
+	try:
+		model.load_weights(weights)
+	except ValueError as e:
+		raise ValueError("%s doesn't fit the model of %s, was it saved by a mode with its own network (see model_factory)? %s" % (weights, type(env).__name__, e)) from e
+	try:
+		return NumpyPolicy.from_keras(model)
+	except ValueError:
+		return lambda states: np.asarray(model(states))
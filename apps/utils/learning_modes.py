@@ -6,23 +6,56 @@ import tensorflow as tf
 
 from apps.utils import gym_utils
 from apps.utils.environment import BaseEnvironment
-from apps.utils.gym_utils import ReplayBuffer
+from apps.utils.gym_utils import ReplayBuffer, PrioritizedReplayBuffer, NStepAccumulator, Epsilon, seed_sequence
+from apps.utils.inference import NumpyPolicy
+from apps.utils.profiling import Profiler
 
 
 class LearningMode(ABC):
 
-	def __init__(self, env: BaseEnvironment):
+	def __init__(self, env: BaseEnvironment, fast_inference: bool = False):
 		self.env = env
+		self.fast_inference = fast_inference
+		self.policy = None
+		self.policy_outdated = True
+		self.profiler = Profiler()  # Replaced by the gym's own
+		self.last_reward = 0.  # Reward of the last step, so that the gym doesn't compute it again
+		self.action_repeat = 1  # Replaced by the gym's own
+		self.last_steps = 1  # Physics steps played by the last step (less than action_repeat if the agent died), one per environment with step_many
 
 	@abstractmethod
 	def get_model(self) -> keras.Model:
 		pass
 
+	def get_policy(self):
+		"""
+		What predictions are made with : the model itself, or with fast inference, a numpy snapshot of it refreshed after the model changed
+		Models which can't be exported to numpy silently fall back to the keras model
+		"""
+		if not self.fast_inference:
+			return self.get_model()
+		if self.policy is None:
+			try:
+				self.policy = NumpyPolicy.from_keras(self.get_model())
+			except ValueError:
+				self.fast_inference = False
+				return self.get_model()
+		elif self.policy_outdated:
+			self.policy.refresh(self.get_model())
+		self.policy_outdated = False
+		return self.policy
+
 	def get_action(self, state):
 		"""
 		Predict an action to perform given a state of observation
 		"""
-		return self.env.translate_prediction_to_input(self.get_model()(state))
+		return self.env.translate_prediction_to_input(self.get_policy()(state))
+
+	def get_actions(self, states):
+		"""
+		Predict one action per row of observations, with a single model call
+		"""
+		return self.env.translate_predictions_to_inputs(self.get_policy()(states))
 
 	@abstractmethod
 	def step(self) -> bool:
@@ -32,6 +65,21 @@ class LearningMode(ABC):
 		"""
 		pass
 
+	@abstractmethod
+	def step_many(self, envs: list[BaseEnvironment], epsilon: Epsilon = None):
+		"""
+		Plays a simulation step on several environments at once, sharing a single model call between them
+		Exploration happens here, through the given epsilon (decided for each environment)
+		:returns: The rewards and whether each environment terminated
+		"""
+		pass
+
+	def on_episode_ends(self, env_index: int = 0):
+		"""
+		Called by the gym before an environment starts a new episode, whether it died or timed out (env_index is its place in a VectorGym)
+		"""
+		pass
+
 	@abstractmethod
 	def train(self):
 		"""
@@ -41,67 +89,248 @@ class LearningMode(ABC):
 
 	def load(self, path: str):
 		self.get_model().load_weights(path)
+		self.policy_outdated = True
 
 	def save(self, path: str):
 		self.get_model().save(path)
 
+	def seed(self, seed=None):
+		"""
+		Seeds the mode's own randomness : subclasses draw their models' weights again (see initialize_model) and seed their memory
+		"""
+		pass
+
+	@staticmethod
+	def initialize_model(model: keras.Model, seed=None):
+		"""
+		Draws the weights of every layer again, in place, from that layer's own initializers given seeds derived from `seed`
+		Keras' global random state is left alone. Variables whose layer has no matching <name>_initializer keep their values
+		"""
+		variables = [(layer, variable) for layer in model.layers for variable in layer.weights]
+		seeds = seed_sequence(seed).generate_state(len(variables)) & 0x7FFFFFFF
+		for (layer, variable), variable_seed in zip(variables, seeds):
+			initializer = getattr(layer, variable.name + "_initializer", None)
+			if initializer is None:
+				continue
+			config = initializer.get_config()
+			if "seed" in config:
+				config["seed"] = int(variable_seed)
+			variable.assign(initializer.__class__.from_config(config)(variable.shape, dtype=variable.dtype))
+
+	def snapshot(self) -> dict:
+		"""
+		Training state which isn't part of the model's weights (target networks, optimizer slots, counters, ...)
+		"""
+		return {}
+
+	def restore(self, snapshot: dict):
+		pass
+
 
 class DQN(LearningMode):
+	"""
+	Deep Q-Learning, bootstrapping from the max of a target network
+	The target network is either copied over from the online one every update_period updates, or with tau set,
+	nudged towards it after every update (Polyak averaging : target = tau * online + (1 - tau) * target)
+	With n_step > 1, transitions go through an NStepAccumulator before reaching the memory, and are bootstrapped with gamma^n
+	"""
 
-	def __init__(self, env: BaseEnvironment, memory: ReplayBuffer, gamma: float = 0.99, update_period: int = 1000):
-		super().__init__(env)
+	def __init__(self, env: BaseEnvironment, memory: ReplayBuffer, gamma: float = 0.99, update_period: int = 1000, xla: bool = False, fast_inference: bool = True, tau: float = None, n_step: int = 1):
+		super().__init__(env, fast_inference)
 		self.memory = memory
 		self.gamma = gamma
 		self.update_period = update_period
-		self.q_model = env.create_model()
-		self.target_q_model = env.create_model()
+		self.xla = xla
+		self.tau = tau
+		self.n_step = n_step
+		self.accumulator = NStepAccumulator(n_step, gamma) if n_step > 1 else None
+		self.q_model = self.create_model()
+		self.target_q_model = self.create_model()
+		self.target_q_model.set_weights(self.q_model.get_weights())
 		self.ticks = 0
+		self.train_step = self.compile_train_step()
+		# Observations are written into these rather than into new arrays (the memory keeps its own copy)
+		self.observations = np.empty((2, env.get_input_space_size()), dtype=np.float32)
+		self.batch_observations = None
+
+	def create_model(self) -> keras.Model:
+		return self.env.create_model()
 
 	def get_model(self) -> keras.Model:
 		return self.q_model
 
+	def compile_train_step(self):
+		"""
+		Traces the training step once for any batch size (fixed signature), optionally compiled with XLA
+		"""
+		self.q_model.optimizer.build(self.q_model.trainable_variables)
+		input_size = self.env.get_input_space_size()
+		signature = [
+			tf.TensorSpec((None, input_size), tf.float32),  # States
+			tf.TensorSpec((None,), tf.int32),  # Actions
+			tf.TensorSpec((None,), tf.float32),  # Rewards
+			tf.TensorSpec((None, input_size), tf.float32),  # Next states
+			tf.TensorSpec((None,), tf.float32),  # Ends
+			tf.TensorSpec((None,), tf.float32),  # Sample weights
+		]
+		return tf.function(self._train_step, input_signature=signature, jit_compile=self.xla)
+
+	def _evaluate(self, states, next_states):
+		"""
+		Runs the networks of a training step (within the gradient tape)
+		:returns: Q(s, .) from the online network, and the value bootstrapped from each next state
+		"""
+		return self.q_model(states, training=True), tf.reduce_max(self.target_q_model(next_states), axis=1)
+
+	def _train_step(self, states, actions, rewards, next_states, ends, sample_weights):
+		"""
+		Computes the targets, gathers Q(s, a) and applies the gradient in a single graph
+		:returns: The TD errors
+		"""
+		with tf.GradientTape() as tape:
+			q_values, next_values = self._evaluate(states, next_states)
+			target_values = tf.stop_gradient(rewards + (1 - ends) * self.gamma ** self.n_step * next_values)
+			td_errors = target_values - tf.gather(q_values, actions, batch_dims=1)
+			# Same loss as fitting the whole output row with only the picked action's value replaced (mse averages over the actions)
+			loss = tf.reduce_mean(sample_weights * tf.square(td_errors)) / self.env.get_action_space_size()
+
+		gradients = tape.gradient(loss, self.q_model.trainable_variables)
+		self.q_model.optimizer.apply_gradients(zip(gradients, self.q_model.trainable_variables))
+		if self.tau is not None:
+			for target, online in zip(self.target_q_model.weights, self.q_model.weights):
+				target.assign(self.tau * online + (1 - self.tau) * target)
+		return td_errors
+
 	def train(self):
 		sample = self.memory.np_sample()
 		if sample is None:
 			return
 
 		states, actions, rewards, next_states, ends = sample
-		states = np.reshape(states, (self.memory.batch_size, self.env.get_input_space_size()))
-		next_states = np.reshape(next_states, (self.memory.batch_size, self.env.get_input_space_size()))
-
-		state_predictions = self.q_model(states)
-		next_state_predictions = self.target_q_model(next_states)
-
-		max_q_values = tf.reduce_max(next_state_predictions, axis=1)
-		target_values = rewards + (1 - ends) * self.gamma * max_q_values
-
-		target_tensor = state_predictions.numpy()
-		target_tensor[np.arange(self.memory.batch_size), actions] = target_values
+		prioritized = isinstance(self.memory, PrioritizedReplayBuffer)
+		sample_weights = self.memory.last_weights if prioritized else np.ones(len(actions), dtype=np.float32)
 
-		self.q_model.fit(states, target_tensor, batch_size=self.memory.batch_size, epochs=1, verbose=0)
+		td_errors = self.train_step(states, actions, rewards, next_states, ends, sample_weights)
+		self.policy_outdated = True
+		if prioritized:
+			self.memory.update_priorities(self.memory.last_indices, td_errors.numpy())
 
 		self.ticks += 1
-		if self.ticks % self.update_period == 0:
+		if self.tau is None and self.ticks % self.update_period == 0:
 			self.target_q_model.set_weights(self.q_model.get_weights())
 
 	def step(self) -> bool:
+		profiler = self.profiler
+
 		# Observe current state
-		state = self.env.observe()
-		action = self.get_action(state)
+		with profiler.section("observe"):
+			self.env.observe_into(self.observations, 0)
+			state = self.observations[0:1]
+		with profiler.section("get_action"):
+			action = self.get_action(state)
 
-		# Tick the clock
-		self.env.play_step(action, gym_utils.TIME_STEP)
+		# Tick the clock, rewards being computed along the way
+		with profiler.section("play_step"):
+			reward, self.last_steps = self.env.play_steps(action, gym_utils.TIME_STEP, self.action_repeat)
+		ends = self.env.get_state() == BaseEnvironment.STATE_DIED
+		self.last_reward = reward
 
 		# Observe next state
-		next_state, reward, ends = self.env.observe(), self.env.compute_reward(), self.env.get_state() == BaseEnvironment.STATE_DIED
+		with profiler.section("observe"):
+			self.env.observe_into(self.observations, 1)
+			next_state = self.observations[1:2]
 
 		# Remember
-		self.memory.remember(state, action, reward, next_state, int(ends))
+		with profiler.section("remember"):
+			if self.accumulator is not None:
+				self.accumulator.push(self.memory, state, [action], [reward], next_state, [ends])
+			else:
+				self.memory.remember(state, action, reward, next_state, int(ends))
 
 		return ends
 
+	def step_many(self, envs: list[BaseEnvironment], epsilon: Epsilon = None):
+		profiler = self.profiler
+
+		if self.batch_observations is None or len(self.batch_observations) != 2 * len(envs):
+			self.batch_observations = np.empty((2 * len(envs), self.env.get_input_space_size()), dtype=np.float32)
+		states, next_states = self.batch_observations[:len(envs)], self.batch_observations[len(envs):]
+
+		with profiler.section("observe"):
+			BaseEnvironment.observe_many(envs, states)
+		with profiler.section("get_action"):
+			actions = np.asarray(self.get_actions(states))
+			if epsilon is not None:
+				for i, env in enumerate(envs):
+					if epsilon.decide_greedy():
+						actions[i] = env.random_input()
+
+		with profiler.section("play_step"):
+			played = [env.play_steps(action, gym_utils.TIME_STEP, self.action_repeat) for env, action in zip(envs, actions)]
+			rewards = np.array([reward for reward, _ in played], dtype=np.float32)
+			self.last_steps = np.array([steps for _, steps in played])
+		ends = np.array([env.get_state() == BaseEnvironment.STATE_DIED for env in envs])
+
+		with profiler.section("observe"):
+			BaseEnvironment.observe_many(envs, next_states)
+
+		with profiler.section("remember"):
+			if self.accumulator is not None:
+				self.accumulator.push(self.memory, states, actions, rewards, next_states, ends)
+			else:
+				self.memory.remember_batch(states, actions, rewards, next_states, ends.astype(np.float32))
+
+		return rewards, ends
+
+	def seed(self, seed=None):
+		model_seed, memory_seed = seed_sequence(seed).spawn(2)
+		self.initialize_model(self.q_model, model_seed)
+		self.target_q_model.set_weights(self.q_model.get_weights())
+		self.policy_outdated = True
+		self.memory.seed(memory_seed)
+
+	def on_episode_ends(self, env_index: int = 0):
+		if self.accumulator is not None:
+			self.accumulator.discard(env_index)
+
 	def load(self, path: str):
 		super().load(path)
 		self.target_q_model.set_weights(self.q_model.get_weights())
 
+	def snapshot(self) -> dict:
+		return {
+			"ticks": self.ticks,
+			"target_weights": self.target_q_model.get_weights(),
+			"optimizer": [np.array(variable) for variable in self.q_model.optimizer.variables]
+		}
+
+	def restore(self, snapshot: dict):
+		self.ticks = int(snapshot["ticks"])
+		self.target_q_model.set_weights(snapshot["target_weights"])
+		for variable, value in zip(self.q_model.optimizer.variables, snapshot["optimizer"]):
+			variable.assign(value)
+
+
+class DoubleDQN(DQN):
+	"""
+	Double DQN : the online network picks the next action, the target network tells how good it is, which curbs the
+	overestimation coming from taking the max of noisy estimates
+	The online network is run once over the states and next states stacked together, so that an update still costs
+	two forward passes like with DQN
+	"""
+
+	def _evaluate(self, states, next_states):
+		q_values, next_online_q_values = tf.split(self.q_model(tf.concat([states, next_states], axis=0), training=True), 2)
+		next_actions = tf.argmax(tf.stop_gradient(next_online_q_values), axis=1, output_type=tf.int32)
+		return q_values, tf.gather(self.target_q_model(next_states), next_actions, batch_dims=1)
+
+
+class DuelingDQN(DoubleDQN):
+	"""
+	Double DQN on a dueling network : the environment's model with its output layer split into a state value head and an advantage head
+	Dueling networks aren't plain stacks of Dense layers, so predictions go through keras even with fast_inference
+	"""
 
+	def create_model(self) -> keras.Model:
+		from apps.utils.models import create_env_dueling_model
+		return create_env_dueling_model(self.env)
@@ -0,0 +1,146 @@
+import atexit
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+EPISODE_METRICS = ("episode", "ticks", "simulated_time", "real_duration", "total_reward", "average_reward", "epsilon", "reward_ewma")
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(dtype: np.dtype, rows: int) -> bytes:
+	"""
+	Version 1.0 .npy header for a 1D array of `rows` records, padded to a fixed size so that it can be rewritten in place as rows are appended
+	"""
+	header = "{'descr': %r, 'fortran_order': False, 'shape': (%%d,), }" % (np.lib.format.dtype_to_descr(dtype),)
+	size = (len(_NPY_MAGIC) + 2 + len(header % (2 ** 63)) + 1 + 63) // 64 * 64  # Only depends on the dtype, 64 bytes aligned
+	header = header % rows
+	return _NPY_MAGIC + struct.pack("<H", size - len(_NPY_MAGIC) - 2) + (header.ljust(size - len(_NPY_MAGIC) - 3) + "\n").encode("latin1")
+
+
+class MetricsWriter:
+	"""
+	Append-only log of one row of metrics per call to log(), e.g. one per episode
+	Rows go to a fixed-size block in memory, which is handed over to a background thread once full, so that the training
+	loop neither does any I/O nor keeps its whole history in memory
+	The format comes from the file extension :
+		.csv => Text, with a header line
+		.npy => Record array (one float64 field per column) growing in place, read back with np.load(path)["column"]
+	Logging into an existing file appends to it, the columns must then be the same
+	"""
+
+	def __init__(self, path: str, columns: tuple = EPISODE_METRICS, batch_size: int = 1000):
+		self.path = path
+		self.columns = tuple(columns)
+		self.indices = {column: i for i, column in enumerate(self.columns)}
+		self.batch_size = batch_size
+		self.dtype = np.dtype([(column, np.float64) for column in self.columns])
+		self.binary = os.path.splitext(path)[1] == ".npy"
+		if not self.binary and os.path.splitext(path)[1] != ".csv":
+			raise ValueError("Unsupported metrics format: %s (.csv or .npy)" % path)
+
+		self.block = self._new_block()
+		self.rows = 0  # Rows in the current block
+		self.written = self._open()  # Rows already in the file
+		self.blocks = queue.Queue()
+		self.thread = None  # Started along with the first block handed over
+
+	def _new_block(self) -> np.ndarray:
+		return np.full((self.batch_size, len(self.columns)), np.nan)
+
+	def _open(self) -> int:
+		directory = os.path.dirname(self.path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+		if not self.binary:
+			if exists:
+				with open(self.path) as f:
+					if tuple(f.readline().strip().split(",")) != self.columns:
+						raise ValueError("%s doesn't have the columns %s" % (self.path, ",".join(self.columns)))
+				return 0
+			with open(self.path, "w") as f:
+				f.write(",".join(self.columns) + "\n")
+			return 0
+
+		if exists:
+			with open(self.path, "rb") as f:
+				if np.lib.format.read_magic(f) != (1, 0):
+					raise ValueError("%s wasn't written by a MetricsWriter" % self.path)
+				shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+			if dtype != self.dtype:
+				raise ValueError("%s doesn't have the columns %s" % (self.path, ",".join(self.columns)))
+			return shape[0]
+		with open(self.path, "wb") as f:
+			f.write(_npy_header(self.dtype, 0))
+		return 0
+
+	def log(self, **values):
+		"""
+		Adds a row, columns left out being NaN
+		"""
+		row = self.block[self.rows]
+		for column, value in values.items():
+			row[self.indices[column]] = value
+		self.rows += 1
+		if self.rows == self.batch_size:
+			self._hand_over()
+
+	def _hand_over(self):
+		if self.rows > 0:
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+				self.thread.start()
+				atexit.register(self.flush)
+			self.blocks.put(self.block[:self.rows])
+			self.block, self.rows = self._new_block(), 0
+
+	def _run(self):
+		while True:
+			block = self.blocks.get()
+			if block is None:
+				self.blocks.task_done()
+				return
+			try:
+				self._write(block)
+			except Exception as e:
+				print("> Metrics couldn't be written to %s: %r" % (self.path, e))
+			finally:
+				self.blocks.task_done()
+
+	def _write(self, block: np.ndarray):
+		if not self.binary:
+			with open(self.path, "a") as f:
+				np.savetxt(f, block, delimiter=",", fmt="%.10g")
+			return
+
+		records = np.ascontiguousarray(block).view(self.dtype).ravel()
+		with open(self.path, "r+b") as f:
+			f.seek(0, os.SEEK_END)
+			f.write(records.tobytes())
+			self.written += len(records)
+			f.seek(0)
+			f.write(_npy_header(self.dtype, self.written))
+
+	def flush(self):
+		"""
+		Writes any pending row and waits for the file to be up to date
+		"""
+		self._hand_over()
+		self.blocks.join()
+
+	def close(self):
+		"""
+		Writes any pending row, then stops the writer thread (logging more rows starts a new one)
+		"""
+		self._hand_over()
+		if self.thread is None:
+			return
+		self.blocks.put(None)
+		self.thread.join()
+		self.thread = None
+		atexit.unregister(self.flush)
@@ -0,0 +1,43 @@
+import keras
+
+
+@keras.saving.register_keras_serializable(package="apps")
+class DuelingAggregation(keras.layers.Layer):
+	"""
+	Combines a state value V(s) of shape (batch, 1) and advantages A(s, a) of shape (batch, actions) into Q(s, a) = V(s) + A(s, a) - mean(A(s, .))
+	"""
+
+	def call(self, inputs):
+		value, advantages = inputs
+		return value + advantages - keras.ops.mean(advantages, axis=1, keepdims=True)
+
+	def compute_output_shape(self, input_shape):
+		return input_shape[1]
+
+
+def create_dueling_model(base: keras.Model) -> keras.Model:
+	"""
+	Turns a Sequential model from create_model into a dueling one : its hidden layers are shared, and its output layer is
+	replaced by a value head and an advantage head of the same kind. The result is compiled like the base model
+	"""
+	hidden, output = base.layers[:-1], base.layers[-1]
+	inputs = keras.Input(shape=base.input_shape[1:])
+	x = inputs
+	for layer in hidden:
+		x = layer(x)
+
+	head_config = output.get_config()
+	head_config.pop("name", None)
+	value = keras.layers.Dense.from_config(dict(head_config, units=1, activation='linear'))(x)
+	advantages = keras.layers.Dense.from_config(dict(head_config, activation='linear'))(x)
+
+	model = keras.Model(inputs, DuelingAggregation()([value, advantages]))
+	model.compile(loss=base.loss, optimizer=keras.optimizers.get(keras.optimizers.serialize(base.optimizer)))
+	return model
+
+
+def create_env_dueling_model(env) -> keras.Model:
+	"""
+	Dueling version of env.create_model(), as built by DuelingDQN (a picklable model_factory for load_policy, evaluate, PolicyServer)
+	"""
+	return create_dueling_model(env.create_model())
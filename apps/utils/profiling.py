@@ -0,0 +1,88 @@
+import contextlib
+import json
+import os
+import time
+
+_NULL_SECTION = contextlib.nullcontext()
+
+
+class _Section:
+	"""
+	Timer for one named phase, reused every time that phase runs (sections of the same name must not be nested)
+	"""
+
+	def __init__(self, profiler: 'Profiler', name: str):
+		self.profiler = profiler
+		self.name = name
+		self.start = 0.
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		end = time.perf_counter()
+		profiler = self.profiler
+		profiler.totals[self.name] = profiler.totals.get(self.name, 0.) + end - self.start
+		profiler.counts[self.name] = profiler.counts.get(self.name, 0) + 1
+		if profiler.trace_events is not None and len(profiler.trace_events) < profiler.max_trace_events:
+			profiler.trace_events.append((self.name, self.start, end - self.start))
+
+
+class Profiler:
+	"""
+	Named timers around the phases of a gym step : observe, get_action, play_step (the action_repeat steps along with their rewards), remember and train
+	Times add up until flush() hands them over to the gym, which adds them to the episode's and the run's StatisticsContainer.phase_times
+	When disabled, section() returns a shared no-op context manager, so instrumented code costs next to nothing
+
+	Keyword arguments:
+
+		report_interval => Print a report every this many episodes (0 to never print any)
+		trace => Keep every timed section, to be exported with export_trace as a Chrome trace (chrome://tracing, Perfetto)
+		max_trace_events => Stop recording trace events past this count, so that long runs don't eat up the memory
+	"""
+
+	def __init__(self, enabled: bool = False, **kwargs):
+		self.enabled = enabled
+		self.report_interval = kwargs.get('report_interval', 0)
+		self.max_trace_events = kwargs.get('max_trace_events', 1000000)
+		self.trace_events = [] if kwargs.get('trace', False) else None
+		self.totals, self.counts = {}, {}
+		self.sections = {}
+
+	def section(self, name: str):
+		if not self.enabled:
+			return _NULL_SECTION
+		section = self.sections.get(name)
+		if section is None:
+			section = self.sections[name] = _Section(self, name)
+		return section
+
+	def flush(self) -> dict:
+		"""
+		:returns: The time spent in each phase since the last flush, as {name: (total seconds, calls)}
+		"""
+		times = {name: (total, self.counts[name]) for name, total in self.totals.items()}
+		self.totals, self.counts = {}, {}
+		return times
+
+	def should_report(self, episode_number: int) -> bool:
+		return self.enabled and self.report_interval > 0 and episode_number % self.report_interval == 0
+
+	@staticmethod
+	def format_report(phase_times: dict) -> str:
+		total = sum(t for t, _ in phase_times.values()) or 1
+		lines = ["%-16s %10s %10s %12s %7s" % ("Phase", "Calls", "Total", "Per call", "Share")]
+		for name, (t, count) in sorted(phase_times.items(), key=lambda item: -item[1][0]):
+			lines.append("%-16s %10d %9.3fs %10.1fus %6.1f%%" % (name, count, t, t / max(count, 1) * 1e6, t / total * 100))
+		return "\n".join(lines)
+
+	def export_trace(self, path: str):
+		"""
+		Writes the recorded sections in the Chrome trace event format
+		"""
+		if self.trace_events is None:
+			raise RuntimeError("The profiler wasn't created with trace=True")
+		pid = os.getpid()
+		events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": 0} for name, start, duration in self.trace_events]
+		with open(path, "w") as f:
+			json.dump({"traceEvents": events}, f)
@@ -0,0 +1,253 @@
+import multiprocessing as mp
+import os
+import pathlib
+import queue
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from apps.utils import gym_utils
+from apps.utils.checkpoint import Checkpointer
+from apps.utils.environment import BaseEnvironment
+from apps.utils.gym import BaseGym
+from apps.utils.gym_utils import Epsilon, GymStatistics, ReplayBuffer, TrainingSettings, seed_sequence
+from apps.utils.inference import NumpyPolicy
+from apps.utils.metrics import MetricsWriter
+
+if TYPE_CHECKING:
+	from apps.utils.learning_modes import LearningMode
+
+
+def _flatten(weights) -> np.ndarray:
+	return np.concatenate([np.ravel(w) for w in weights]).astype(np.float32)
+
+
+def _unflatten(flat: np.ndarray, shapes: list) -> list:
+	weights, offset = [], 0
+	for shape in shapes:
+		size = int(np.prod(shape))
+		weights.append(flat[offset:offset + size].reshape(shape))
+		offset += size
+	return weights
+
+
+def _rollout_worker(env_factory, policy: NumpyPolicy, envs_count: int, epsilon: Epsilon, episode_time: int, action_repeat: int, chunk_size: int, transitions, shared_weights, weights_version, stop, seed):
+	"""
+	Worker process loop : steps its own environments with a local numpy copy of the policy, and ships transitions back by chunks
+	"""
+	envs: list[BaseEnvironment] = [env_factory() for _ in range(envs_count)]
+	if seed is not None:
+		*envs_seeds, epsilon_seed = seed.spawn(envs_count + 1)
+		for env, env_seed in zip(envs, envs_seeds):
+			env.seed(env_seed)
+		epsilon.seed(epsilon_seed)
+	for env in envs:
+		env.setup_environment()
+		env.new_episode_case()
+
+	shapes = [w.shape for w in policy.get_weights()]
+	shared_view = np.frombuffer(shared_weights.get_obj(), dtype=np.float32)
+	version = -1
+
+	ticks, returns = np.zeros(envs_count, dtype=np.int64), np.zeros(envs_count)
+	pending, pending_rows, finished = [], 0, []
+	episodes = 0
+	while not stop.is_set():
+		if weights_version.value != version:
+			with shared_weights.get_lock():
+				version, flat = weights_version.value, shared_view.copy()
+			policy.set_weights(_unflatten(flat, shapes))
+
+		states = BaseEnvironment.observe_many(envs)
+		actions = np.asarray(envs[0].translate_predictions_to_inputs(policy(states)))
+		for i, env in enumerate(envs):
+			if epsilon.decide_greedy():
+				actions[i] = env.random_input()
+
+		rewards = np.array([env.play_steps(action, gym_utils.TIME_STEP, action_repeat)[0] for env, action in zip(envs, actions)], dtype=np.float32)
+
+		next_states = BaseEnvironment.observe_many(envs)
+		ends = np.array([env.get_state() == BaseEnvironment.STATE_DIED for env in envs])
+		pending.append((states, actions, rewards, next_states, ends.astype(np.float32)))
+		pending_rows += envs_count
+
+		ticks += 1
+		returns += rewards
+		for i in np.flatnonzero(ends | (0 < episode_time <= ticks)):
+			finished.append(returns[i])
+			ticks[i], returns[i] = 0, 0
+			envs[i].new_episode_case()
+			episodes += 1
+			if episodes % envs_count == 0:  # Once per round of episodes, as if a single environment was played
+				epsilon.decay()
+
+		if pending_rows >= chunk_size:
+			transitions.put((tuple(np.concatenate(column) for column in zip(*pending)), finished))
+			pending, pending_rows, finished = [], 0, []
+
+
+class RolloutPool:
+	"""
+	Pool of worker processes, each owning a few environments and playing them with its own numpy copy of the policy (no tensorflow needed there)
+	Transitions flow back to the learner through a bounded queue (workers wait when the learner lags behind),
+	while the learner publishes fresh weights in a shared memory block that workers pick up whenever its version changes
+	env_factory must be picklable (an environment class is just fine)
+	Workers play each action for action_repeat physics steps (see TrainingSettings), episode_time counting the agent's decisions
+	Every worker decays its copy of epsilon once per envs_per_worker episodes it finishes, so that the schedule doesn't go faster
+	with more environments per worker
+	With a seed, every worker gets its own streams for its environments and epsilon. What each worker plays then only depends on
+	the seed and on when new weights reach it, but the order in which chunks reach the learner is still up to the OS scheduler
+	"""
+
+	def __init__(self, env_factory, workers: int = None, envs_per_worker: int = 8, epsilon: Epsilon = None, episode_time: int = 0, action_repeat: int = 1, chunk_size: int = 256, seed=None):
+		self.env_factory = env_factory
+		self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+		self.envs_per_worker = envs_per_worker
+		self.epsilon = epsilon or Epsilon.none()
+		self.episode_time = episode_time
+		self.action_repeat = action_repeat
+		self.chunk_size = chunk_size
+		self.seed = seed
+
+		self.context = mp.get_context("spawn")  # Forking a process which already runs tensorflow is asking for trouble
+		self.transitions = self.context.Queue(maxsize=4 * self.workers)
+		self.stop_event = self.context.Event()
+		self.shared_weights, self.weights_version = None, self.context.Value('i', 0)
+		self.processes = []
+
+	def start(self, policy: NumpyPolicy):
+		"""
+		Spawns the workers, which all start playing with the given policy
+		"""
+		weights = policy.get_weights()
+		self.shared_weights = self.context.Array('f', int(sum(np.size(w) for w in weights)))
+		self.broadcast(weights)
+		seeds = seed_sequence(self.seed).spawn(self.workers) if self.seed is not None else [None] * self.workers
+		for seed in seeds:
+			process = self.context.Process(
+				target=_rollout_worker,
+				args=(self.env_factory, policy, self.envs_per_worker, self.epsilon, self.episode_time, self.action_repeat, self.chunk_size, self.transitions, self.shared_weights, self.weights_version, self.stop_event, seed),
+				daemon=True
+			)
+			process.start()
+			self.processes.append(process)
+
+	def broadcast(self, weights):
+		"""
+		Publishes new weights, never waiting on the workers (they only copy them between two steps)
+		"""
+		with self.shared_weights.get_lock():
+			np.frombuffer(self.shared_weights.get_obj(), dtype=np.float32)[:] = _flatten(weights)
+			self.weights_version.value += 1
+
+	def collect(self, memory: ReplayBuffer, block: bool = True, timeout: float = None):
+		"""
+		Moves every chunk of transitions sent so far into the memory
+		:returns: How many transitions were received, and the total reward of the episodes which ended in the meantime
+		"""
+		count, episode_returns = 0, []
+		while True:
+			try:
+				chunk, finished = self.transitions.get(block=block and count == 0, timeout=timeout)
+			except queue.Empty:
+				break
+			memory.remember_batch(*chunk)
+			count += len(chunk[1])
+			episode_returns.extend(finished)
+		return count, episode_returns
+
+	def close(self):
+		self.stop_event.set()
+		while any(process.is_alive() for process in self.processes):
+			try:  # Workers might be stuck on a full queue
+				while True:
+					self.transitions.get_nowait()
+			except queue.Empty:
+				pass
+			for process in self.processes:
+				process.join(timeout=0.1)
+		self.processes = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+
+class ParallelGym:
+	"""
+	Learner side of the rollout pool : fills the memory with what the workers played, trains, and broadcasts weights every now and then
+	Exploration happens in the workers, hence the epsilon given to the pool rather than the one from the settings
+	"""
+
+	def __init__(self, pool: RolloutPool, mode: 'LearningMode', settings: TrainingSettings, weights: str = None, train_every: int = 10, broadcast_period: int = 50, **kwargs):
+		if getattr(mode, "n_step", 1) > 1:
+			raise ValueError("Workers store 1-step transitions, n-step returns aren't supported by ParallelGym")
+		self.pool = pool
+		self.mode = mode
+		self.settings = settings
+		self.train_every = train_every
+		self.broadcast_period = broadcast_period
+		self.gym_stats = GymStatistics(mode.env.get_environment_name())
+		self.pending_updates = 0.
+		self.updates = 0
+		self.checkpointer = Checkpointer(mode, None, self.gym_stats, settings.keep_checkpoints, settings.save_replay) if settings.save_model_interval > 0 else None
+		self.metrics = MetricsWriter(settings.metrics_path) if settings.metrics_path is not None else None
+
+		if kwargs.get('resume') is not None:
+			(self.checkpointer or Checkpointer(mode, None, self.gym_stats)).restore(kwargs['resume'])
+		elif weights is not None:
+			self.mode.load(weights)
+		if kwargs.get('summary', True):
+			self.mode.get_model().summary()
+
+		self.pool.start(NumpyPolicy.from_keras(self.mode.get_model()))
+
+	def observing(self) -> bool:
+		return self.gym_stats.ticks_count < self.settings.observe
+
+	def step(self):
+		count, episode_returns = self.pool.collect(self.mode.memory)
+		self.gym_stats.tick(gym_utils.TIME_STEP * self.pool.action_repeat, count)  # Episodes cut short by a death make this a slight overestimate
+
+		for final_reward in episode_returns:
+			if self.observing():  # Like BaseGym, episodes played while observing aren't counted
+				continue
+			self.gym_stats.add_episode(final_reward)
+			eps_id = self.gym_stats.episode_count
+			if self.metrics is not None:
+				self.metrics.log(episode=eps_id, real_duration=self.gym_stats.get_real_duration(), total_reward=final_reward, reward_ewma=self.gym_stats.rewards.ewma)
+			if eps_id % 10 == 1:
+				print(self.settings.episode_end_header(eps_id) + " " + str(self.gym_stats))
+			if self.settings.should_save_model(eps_id):
+				path = self.settings.get_save_path(eps_id)
+				self.checkpointer.save(path, episode=eps_id, ticks=self.gym_stats.ticks_count)
+				print("> Saving model to " + str(pathlib.Path(path).absolute()))
+			if self.settings.is_gym_complete(eps_id, self.gym_stats.get_real_duration()):  # Anything received past that is dropped
+				self.close()
+				return BaseGym.RESULT_GYM_STOPPED
+
+		if not self.observing():
+			self.pending_updates += count / self.train_every
+			while self.pending_updates >= 1:
+				self.pending_updates -= 1
+				self.mode.train()
+				self.updates += 1
+				if self.updates % self.broadcast_period == 0:
+					self.pool.broadcast(self.mode.get_model().get_weights())
+
+		if self.settings.is_gym_complete(self.gym_stats.episode_count, self.gym_stats.get_real_duration()):
+			self.close()
+			return BaseGym.RESULT_GYM_STOPPED
+		return BaseGym.RESULT_NOTHING_NEW
+
+	def close(self):
+		"""
+		Stops the workers and the background writers, done by step() once the gym is complete
+		"""
+		self.pool.close()
+		if self.checkpointer is not None:
+			self.checkpointer.close()
+		if self.metrics is not None:
+			self.metrics.close()
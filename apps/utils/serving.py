@@ -0,0 +1,262 @@
+import asyncio
+import bisect
+import concurrent.futures
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+from apps.utils.environment import BaseEnvironment
+from apps.utils.inference import load_policy
+
+
+class Histogram:
+	"""
+	Counts of recorded values per bucket, bucket i holding the values up to bounds[i] (the last one everything above)
+	Cheap enough to record every single request, percentiles are read from the buckets (upper bound of the one they fall in)
+	"""
+
+	def __init__(self, bounds):
+		self.bounds = [float(bound) for bound in bounds]
+		self.reset()
+
+	def reset(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count, self.total, self.max = 0, 0., 0.
+
+	def record(self, value: float):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.total += value
+		self.max = max(self.max, value)
+
+	@property
+	def mean(self) -> float:
+		return self.total / self.count if self.count > 0 else 0.
+
+	def percentile(self, p: float) -> float:
+		if self.count == 0:
+			return 0.
+		rank = np.ceil(p / 100 * self.count)
+		cumulative = np.cumsum(self.counts)
+		i = int(np.searchsorted(cumulative, max(rank, 1)))
+		return self.bounds[i] if i < len(self.bounds) else self.max
+
+	def to_dict(self) -> dict:
+		return {
+			"bounds": self.bounds, "counts": self.counts, "count": self.count, "mean": self.mean, "max": self.max,
+			"p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99)
+		}
+
+
+class PolicyServer:
+	"""
+	Serves the actions of a policy over a TCP or Unix socket, one JSON object per line each way :
+		{"id": 1, "observation": [...]} => {"id": 1, "action": 0, "prediction": [...], "version": 0}
+		{"command": "stats"} => Latency (seconds, from reception to answer) and batch size histograms
+		{"command": "reload"} => Loads the weights file again
+	A malformed request gets {"error": "..."} (with its id if it has one) and the connection stays open
+	Concurrent requests (from any number of connections, or pipelined on one) are coalesced into batches of at most max_batch_size
+	observations, waiting at most max_wait seconds after the first one for others to come along
+	Batches are evaluated on a worker thread, so that requests keep being read meanwhile (and pile up into the next batch)
+	The weights file is checked every reload_interval seconds (never with 0) and loaded again whenever it changed, e.g. when a
+	training session saves a new checkpoint there. The new policy is loaded aside and swapped between two batches, no request is dropped
+	Weights are loaded into model_factory(env), env.create_model() by default (see load_policy)
+	"""
+
+	def __init__(self, env: BaseEnvironment, weights: str, max_batch_size: int = 64, max_wait: float = 0.002, reload_interval: float = 1., model_factory=None):
+		self.env = env
+		self.weights = weights
+		self.model_factory = model_factory
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.reload_interval = reload_interval
+		self.policy = load_policy(env, weights, model_factory)
+		self.version = 0
+		self.mtime = os.stat(weights).st_mtime_ns
+		self.latency = Histogram([1e-5 * 2 ** i for i in range(18)])  # 10µs to ~1.3s
+		self.batch_sizes = Histogram([2 ** i for i in range(int(np.log2(max_batch_size)) + 1)])
+		self.requests = None
+		self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="inference")
+
+	async def serve(self, host: str = "127.0.0.1", port: int = 8765, path: str = None):
+		"""
+		Serves until cancelled, on a Unix socket if a path is given, on host:port otherwise
+		"""
+		self.requests = asyncio.Queue()
+		if path is not None:
+			server = await asyncio.start_unix_server(self._handle, path)
+		else:
+			server = await asyncio.start_server(self._handle, host, port)
+		tasks = [asyncio.create_task(self._batch())]
+		if self.reload_interval > 0:
+			tasks.append(asyncio.create_task(self._watch()))
+		print("> Serving %s on %s" % (self.weights, path or "%s:%d" % (host, port)))
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			for task in tasks:
+				task.cancel()
+
+	def run(self, host: str = "127.0.0.1", port: int = 8765, path: str = None):
+		try:
+			asyncio.run(self.serve(host, port, path))
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.executor.shutdown()
+
+	async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		pending = set()
+		try:
+			while line := await reader.readline():
+				try:
+					request = json.loads(line)
+				except (json.JSONDecodeError, UnicodeDecodeError) as e:  # Only this request is answered with an error
+					request = e
+				task = asyncio.create_task(self._answer(request, writer))
+				pending.add(task)
+				task.add_done_callback(pending.discard)
+			if pending:
+				await asyncio.wait(pending)
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def _answer(self, request, writer: asyncio.StreamWriter):
+		if isinstance(request, Exception):
+			response = {"error": "Invalid JSON: %s" % request}
+		elif not isinstance(request, dict):
+			response = {"error": "Requests must be JSON objects"}
+		elif "observation" in request:
+			response = await self.act(request["observation"])
+		elif request.get("command") == "stats":
+			response = self.stats()
+		elif request.get("command") == "reload":
+			try:
+				await self.reload()
+				response = {"version": self.version}
+			except Exception as e:  # e.g. a missing or corrupt weights file, the current policy keeps serving
+				response = {"error": "Couldn't reload %s: %s" % (self.weights, e)}
+		else:
+			response = {"error": "Unknown request"}
+		if isinstance(request, dict) and "id" in request:
+			response["id"] = request["id"]
+		writer.write(json.dumps(response).encode() + b"\n")
+
+	async def act(self, observation) -> dict:
+		"""
+		Queues one observation for the next batch, and waits for its answer
+		Observations which don't fit the environment's input space are answered with an error right away, never reaching a batch
+		"""
+		try:
+			observation = np.asarray(observation, dtype=np.float32).ravel()
+		except (TypeError, ValueError) as e:
+			return {"error": "Invalid observation: %s" % e}
+		if observation.size != self.env.get_input_space_size():
+			return {"error": "Observations must have %d values, not %d" % (self.env.get_input_space_size(), observation.size)}
+		future = asyncio.get_running_loop().create_future()
+		await self.requests.put((observation, future, time.perf_counter()))
+		return await future
+
+	async def _batch(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = [await self.requests.get()]
+			deadline = loop.time() + self.max_wait
+			while len(batch) < self.max_batch_size:
+				if not self.requests.empty():
+					batch.append(self.requests.get_nowait())
+					continue
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					batch.append(await asyncio.wait_for(self.requests.get(), timeout))
+				except asyncio.TimeoutError:
+					break
+
+			policy, version = self.policy, self.version  # Swaps only ever happen between two batches
+			try:
+				predictions = await loop.run_in_executor(self.executor, policy, np.stack([observation for observation, _, _ in batch]))
+				actions = self.env.translate_predictions_to_inputs(predictions)
+			except Exception as e:
+				for _, future, _ in batch:
+					if not future.done():
+						future.set_result({"error": repr(e)})
+				continue
+
+			now = time.perf_counter()
+			for (_, future, received), action, prediction in zip(batch, actions, predictions):
+				if not future.done():
+					future.set_result({"action": int(action), "prediction": prediction.tolist(), "version": version})
+				self.latency.record(now - received)
+			self.batch_sizes.record(len(batch))
+
+	async def reload(self):
+		"""
+		Loads the weights file again on another thread, then swaps the policy in
+		"""
+		mtime = os.stat(self.weights).st_mtime_ns
+		self.policy = await asyncio.get_running_loop().run_in_executor(None, load_policy, self.env, self.weights, self.model_factory)
+		self.version += 1
+		self.mtime = mtime
+		print("> Loaded %s (version %d)" % (self.weights, self.version))
+
+	async def _watch(self):
+		while True:
+			await asyncio.sleep(self.reload_interval)
+			try:
+				if os.stat(self.weights).st_mtime_ns != self.mtime:
+					await self.reload()
+			except Exception as e:  # e.g. the file being replaced right now, next check will do
+				print("> Couldn't reload %s: %r" % (self.weights, e))
+
+	def stats(self) -> dict:
+		return {"version": self.version, "latency": self.latency.to_dict(), "batch_size": self.batch_sizes.to_dict()}
+
+
+class PolicyClient:
+	"""
+	Blocking client for a PolicyServer, one request at a time
+	"""
+
+	def __init__(self, host: str = "127.0.0.1", port: int = 8765, path: str = None):
+		if path is not None:
+			self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.socket.connect(path)
+		else:
+			self.socket = socket.create_connection((host, port))
+			self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.file = self.socket.makefile("rwb")
+
+	def request(self, request: dict) -> dict:
+		"""
+		Sends a request and waits for its answer, raising a RuntimeError if the server answered with an error
+		"""
+		self.file.write(json.dumps(request).encode() + b"\n")
+		self.file.flush()
+		response = json.loads(self.file.readline())
+		if "error" in response:
+			raise RuntimeError("Policy server error: %s" % response["error"])
+		return response
+
+	def reload(self) -> int:
+		"""
+		:returns: The version of the policy now served
+		"""
+		return self.request({"command": "reload"})["version"]
+
+	def act(self, observation) -> int:
+		return self.request({"observation": np.asarray(observation, dtype=np.float32).ravel().tolist()})["action"]
+
+	def stats(self) -> dict:
+		return self.request({"command": "stats"})
+
+	def close(self):
+		self.file.close()
+		self.socket.close()
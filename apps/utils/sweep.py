@@ -0,0 +1,179 @@
+import concurrent.futures
+import copy
+import csv
+import itertools
+import math
+import multiprocessing as mp
+import os
+import time
+import traceback
+
+import numpy as np
+
+from apps.utils.gym_utils import seed_sequence
+
+RESULT_COLUMNS = ("trial", "status", "episodes", "ticks", "duration", "reward_mean", "reward_ewma", "reward_best_ewma", "reward_max")
+
+
+def grid(space: dict) -> list[dict]:
+	"""
+	Every combination of the given values, e.g. grid({"gamma": [0.9, 0.99], "batch_size": [32, 128]}) gives 4 trials
+	"""
+	names = list(space)
+	return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def log_uniform(low: float, high: float):
+	"""
+	Random search distribution for scale parameters (learning rates, decays, ...)
+	"""
+	return lambda rng: float(math.exp(rng.uniform(math.log(low), math.log(high))))
+
+
+def random_search(space: dict, trials: int, seed: int = None) -> list[dict]:
+	"""
+	Trials picked at random : lists are choices, (low, high) tuples are uniform ranges (integers if both bounds are),
+	and callables are distributions, called with a numpy Generator
+	"""
+	rng = np.random.default_rng(seed)
+
+	def pick(values):
+		if callable(values):
+			return values(rng)
+		if isinstance(values, tuple):
+			low, high = values
+			if isinstance(low, int) and isinstance(high, int):
+				return int(rng.integers(low, high + 1))
+			return float(rng.uniform(low, high))
+		return values[rng.integers(len(values))]
+	return [{name: pick(values) for name, values in space.items()} for _ in range(trials)]
+
+
+class EarlyStopping:
+	"""
+	Gives up on a run once its episode rewards (exponentially weighted mean from GymStatistics) stopped improving
+	Keyword arguments:
+
+		grace => Episodes always played before any decision
+		patience => Episodes without improving the best reward by more than min_delta after which the run is stopped
+		min_delta => Smallest improvement that counts
+		min_reward => Stop as soon as the reward is below this value after the grace period (None to disable)
+	"""
+
+	def __init__(self, **kwargs):
+		self.grace = kwargs.get('grace', 50)
+		self.patience = kwargs.get('patience', 100)
+		self.min_delta = kwargs.get('min_delta', 0.)
+		self.min_reward = kwargs.get('min_reward', None)
+		self.best, self.best_episode = float('-inf'), 0
+
+	def should_stop(self, gym_stats) -> bool:
+		episode, reward = gym_stats.get_episode_count(), gym_stats.rewards.ewma
+		if reward > self.best + self.min_delta:
+			self.best, self.best_episode = reward, episode
+		if episode < self.grace:
+			return False
+		if self.min_reward is not None and reward < self.min_reward:
+			return True
+		return episode - self.best_episode >= self.patience
+
+
+def init_worker(threads: int):
+	"""
+	Pins TensorFlow (and the math libraries under numpy) to a few threads, so that workers don't fight over the cores
+	Runs in the freshly spawned worker, before anything imports TensorFlow (initializer of the sweep and evaluation process pools)
+	"""
+	for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+		os.environ[variable] = str(threads)
+	os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+	os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+	import tensorflow as tf
+	tf.config.threading.set_intra_op_parallelism_threads(threads)
+	tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_trial(factory, params: dict, trial: int = 0, max_episodes: int = 0, max_duration: float = 0, early_stopping: EarlyStopping = None) -> dict:
+	"""
+	Builds a gym with factory(**params, summary=False) and trains it until it stops by itself, max_episodes episodes were played,
+	max_duration seconds went by, or early stopping kicks in
+	:returns: One row of results (RESULT_COLUMNS followed by the parameters)
+	"""
+	from apps.utils.gym import BaseGym
+	early_stopping = copy.copy(early_stopping)  # Starts over for every trial
+	result = dict.fromkeys(RESULT_COLUMNS)
+	result.update(trial=trial, status="done")
+	start, gym = time.time(), None
+	try:
+		gym = factory(**params, summary=False)
+		stats, best, episodes = gym.gym_stats, float('-inf'), 0
+		while gym.step() != BaseGym.RESULT_GYM_STOPPED:
+			if 0 < max_duration <= time.time() - start:  # On every step, observing and long episodes count as well
+				break
+			if stats.episode_count == episodes:
+				continue
+			episodes = stats.episode_count
+			best = max(best, stats.rewards.ewma)
+			if 0 < max_episodes <= episodes:
+				break
+			if early_stopping is not None and early_stopping.should_stop(stats):
+				result["status"] = "stopped"
+				break
+		result.update(
+			episodes=stats.episode_count, ticks=stats.ticks_count, reward_mean=stats.get_average_reward(), reward_ewma=stats.rewards.ewma,
+			reward_best_ewma=max(best, stats.rewards.ewma), reward_max=stats.rewards.max
+		)
+	except Exception:
+		result["status"] = "failed"
+		traceback.print_exc()
+	finally:
+		if gym is not None:
+			gym.close()  # Workers are reused for other trials, nothing of this one should stay around
+	result["duration"] = time.time() - start
+	for name, value in params.items():  # Seeds spawned by run_sweep are written as (entropy, spawn_key), enough to rebuild them
+		result[name] = (value.entropy, value.spawn_key) if isinstance(value, np.random.SeedSequence) else value
+	return result
+
+
+def run_sweep(factory, trials: list[dict], workers: int = None, threads_per_worker: int = 1, seed=None, **kwargs) -> list[dict]:
+	"""
+	Runs every trial (a dict of parameters for the factory, see grid and random_search) across a pool of processes
+	The factory has to be a module-level function building a BaseGym (like build_gym in apps/cart_pole/gym.py), as workers are spawned
+	With a seed, each trial gets its own seed (spawned from it) as a `seed` parameter, making every trial reproducible
+	Other keyword arguments (max_episodes, max_duration, early_stopping) go to run_trial
+	:returns: One row of results per trial, the best ones (highest final reward_ewma) first
+	"""
+	workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+	results = []
+	with concurrent.futures.ProcessPoolExecutor(workers, mp.get_context("spawn"), init_worker, (threads_per_worker,)) as pool:
+		if seed is not None:
+			trials = [dict(params, seed=trial_seed) for params, trial_seed in zip(trials, seed_sequence(seed).spawn(len(trials)))]
+		futures = [pool.submit(run_trial, factory, params, trial, **kwargs) for trial, params in enumerate(trials)]
+		for future in concurrent.futures.as_completed(futures):
+			result = future.result()
+			results.append(result)
+			print("> Trial %d/%d %s after %s episodes: reward_ewma=%s" % (len(results), len(trials), result["status"], result["episodes"], format_value(result["reward_ewma"])))
+	return sorted(results, key=lambda result: -result["reward_ewma"] if result["reward_ewma"] is not None else math.inf)
+
+
+def format_value(value) -> str:
+	"""
+	Table cell for a result value (see format_table), floats being rounded to 4 significant digits
+	"""
+	if isinstance(value, float):
+		return "%.4g" % value
+	return "-" if value is None else str(value)
+
+
+def format_table(results: list[dict]) -> str:
+	columns = list(RESULT_COLUMNS) + sorted({name for result in results for name in result} - set(RESULT_COLUMNS))
+	rows = [columns] + [[format_value(result.get(column)) for column in columns] for result in results]
+	widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+	return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def write_csv(path: str, results: list[dict]):
+	columns = list(RESULT_COLUMNS) + sorted({name for result in results for name in result} - set(RESULT_COLUMNS))
+	with open(path, "w", newline="") as f:
+		writer = csv.DictWriter(f, columns)
+		writer.writeheader()
+		writer.writerows(results)
@@ -0,0 +1,60 @@
+import argparse
+import sys
+
+from benchmarks import physics_profiles
+from benchmarks.harness import run_all, write_results, read_results, compare
+from benchmarks.suite import BENCHMARKS
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs the performance benchmarks, or compares two runs")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	run = commands.add_parser("run", help="Run the benchmarks")
+	run.add_argument("-o", "--output", help="Where to write the results (JSON)")
+	run.add_argument("-k", "--filter", help="Only run the benchmarks whose name contains this string")
+	run.add_argument("--warmup", type=int, default=3)
+	run.add_argument("--repeats", type=int, default=20)
+
+	cmp = commands.add_parser("compare", help="Compare two result files, failing if anything regressed")
+	cmp.add_argument("baseline")
+	cmp.add_argument("current")
+	cmp.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown considered as a regression (default: 0.1)")
+	cmp.add_argument("--metric", default="p50", help="Statistic to compare (default: p50)")
+
+	list_cmd = commands.add_parser("list", help="List the available benchmarks")
+
+	profiles = commands.add_parser("profiles", help="Speed and trajectory drift of every physics profile")
+	profiles.add_argument("-o", "--output", help="Where to write the results (JSON)")
+	profiles.add_argument("--episodes", type=int, default=20)
+	profiles.add_argument("--horizon", type=int, default=50, help="Steps played from each starting state (default: 50)")
+
+	args = parser.parse_args()
+	if args.command == "list":
+		for benchmark in BENCHMARKS:
+			print("%-10s %s" % (benchmark.group, benchmark.name))
+		return 0
+
+	if args.command == "profiles":
+		results = physics_profiles.main(episodes=args.episodes, horizon=args.horizon)
+		if args.output:
+			write_results(args.output, results)
+			print("> Results written to " + args.output)
+		return 0
+
+	if args.command == "run":
+		results = run_all(BENCHMARKS, args.filter, args.warmup, args.repeats)
+		if args.output:
+			write_results(args.output, results)
+			print("> Results written to " + args.output)
+		return 0
+
+	regressions = compare(read_results(args.baseline), read_results(args.current), args.threshold, args.metric)
+	if regressions:
+		print("\n%d regression(s) above %.0f%%: %s" % (len(regressions), args.threshold * 100, ", ".join(regressions)))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,111 @@
+import json
+import platform
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class Benchmark:
+	"""
+	A named piece of code to be timed
+	setup is called once and returns the function to time, so that building models or filling buffers stays out of the measures
+	number is how many times that function is called per repeat (timings are reported per call)
+	repeats and warmup override the ones given to run, for benchmarks too slow to be repeated as much as the others
+	"""
+
+	def __init__(self, name: str, setup, number: int = 1, group: str = "misc", repeats: int = None, warmup: int = None):
+		self.name = name
+		self.setup = setup
+		self.number = number
+		self.group = group
+		self.repeats = repeats
+		self.warmup = warmup
+
+	def run(self, warmup: int = 3, repeats: int = 20) -> dict:
+		warmup = warmup if self.warmup is None else self.warmup
+		repeats = repeats if self.repeats is None else self.repeats
+		random.seed(0)  # The global random state doesn't depend on which benchmarks ran before
+		np.random.seed(0)
+		fn = self.setup()
+		for _ in range(warmup):
+			fn()
+
+		samples = np.empty(repeats)
+		for i in range(repeats):
+			start = time.perf_counter()
+			for _ in range(self.number):
+				fn()
+			samples[i] = (time.perf_counter() - start) / self.number
+
+		result = {
+			"group": self.group,
+			"number": self.number,
+			"repeats": repeats,
+			"mean": float(samples.mean()),
+			"std": float(samples.std()),
+			"min": float(samples.min()),
+			"max": float(samples.max()),
+			"ops_per_sec": float(1 / samples.mean()),
+		}
+		for p in PERCENTILES:
+			result["p%d" % p] = float(np.percentile(samples, p))
+		return result
+
+
+def run_all(benchmarks: list[Benchmark], name_filter: str = None, warmup: int = 3, repeats: int = 20) -> dict:
+	results = {}
+	for benchmark in benchmarks:
+		if name_filter and name_filter not in benchmark.name:
+			continue
+		print("> %s... " % benchmark.name, end='', flush=True)
+		results[benchmark.name] = result = benchmark.run(warmup, repeats)
+		print(format_duration(result["p50"]) + " (p90: %s)" % format_duration(result["p90"]))
+	return results
+
+
+def format_duration(seconds: float) -> str:
+	for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+		if seconds >= scale:
+			return "%.3f%s" % (seconds / scale, unit)
+	return "%.1fns" % (seconds * 1e9)
+
+
+def write_results(path: str, results: dict):
+	with open(path, "w") as f:
+		json.dump({
+			"date": datetime.now().isoformat(timespec='seconds'),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"processor": platform.processor(),
+			"results": results
+		}, f, indent=2)
+
+
+def read_results(path: str) -> dict:
+	with open(path) as f:
+		return json.load(f)["results"]
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, metric: str = "p50") -> list[str]:
+	"""
+	Prints how each benchmark evolved between two runs
+	:returns: The names of the benchmarks which got slower by more than the threshold (relative)
+	"""
+	regressions = []
+	print("%-45s %12s %12s %9s" % ("Benchmark", "Baseline", "Current", "Change"))
+	for name in sorted(set(baseline) | set(current)):
+		if name not in baseline or name not in current:
+			print("%-45s %12s %12s %9s" % (name, format_duration(baseline[name][metric]) if name in baseline else "-", format_duration(current[name][metric]) if name in current else "-", "n/a"))
+			continue
+		before, after = baseline[name][metric], current[name][metric]
+		change = after / before - 1
+		flag = ""
+		if change > threshold:
+			regressions.append(name)
+			flag = "  << REGRESSION"
+		print("%-45s %12s %12s %+8.1f%%%s" % (name, format_duration(before), format_duration(after), change * 100, flag))
+	return regressions
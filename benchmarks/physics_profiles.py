@@ -0,0 +1,83 @@
+"""
+Speed and accuracy of every physics profile : ticks per second, and how far trajectories drift away from a reference simulation
+(many more solver iterations and substeps) when both play the same actions from the same starting state
+"""
+import time
+
+import numpy as np
+
+from apps.utils import gym_utils
+from apps.utils.environment import PhysicsProfile
+
+PROFILES = ("fast", "balanced", "accurate")
+REFERENCE = PhysicsProfile("reference", iterations=100, substeps=16)
+
+
+def _environments():
+	from apps.cart.environment import CartEnvironment_V2
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	return {"cart_pole": CartPoleEnvironment_V3, "cart": CartEnvironment_V2}
+
+
+def _start(env_class, profile, seed: int):
+	env = env_class(profile)
+	env.seed(seed)
+	env.setup_environment()
+	env.new_episode_case()
+	return env
+
+
+def ticks_per_second(env_class, profile, ticks: int = 5000) -> float:
+	"""
+	Physics steps per second with random inputs, episodes being restarted whenever the agent dies
+	"""
+	env = _start(env_class, profile, 0)
+	actions = np.random.default_rng(0).integers(env.get_action_space_size(), size=ticks)
+
+	def play(actions):
+		for action in actions:
+			env.play_step(action, gym_utils.TIME_STEP)
+			if env.get_state() == env.STATE_DIED:
+				env.new_episode_case()
+	play(actions[:ticks // 10])  # Warm up
+	start = time.perf_counter()
+	play(actions)
+	return ticks / (time.perf_counter() - start)
+
+
+def trajectory(env, actions) -> np.ndarray:
+	"""
+	Observations after every step, the episode going on even if the agent died (so that every profile plays as many steps)
+	"""
+	observations = np.empty((len(actions), env.get_input_space_size()), dtype=np.float32)
+	for tick, action in enumerate(actions):
+		env.play_step(action, gym_utils.TIME_STEP)
+		env.observe_into(observations, tick)
+	return observations
+
+
+def drift(env_class, profile, episodes: int = 20, horizon: int = 50) -> dict:
+	"""
+	Absolute observation errors against REFERENCE over `horizon` steps of random inputs, from `episodes` different starting states
+	:returns: The error averaged over every step, and the error after the last one (both averaged over the episodes, one value per observation)
+	"""
+	errors = []
+	for episode in range(episodes):
+		env = _start(env_class, profile, episode)
+		actions = np.random.default_rng(episode).integers(env.get_action_space_size(), size=horizon)
+		errors.append(np.abs(trajectory(env, actions) - trajectory(_start(env_class, REFERENCE, episode), actions)))
+	errors = np.array(errors)
+	return {"mean": errors.mean(axis=(0, 1)), "final": errors[:, -1].mean(axis=0)}
+
+
+def main(profiles=PROFILES, episodes: int = 20, horizon: int = 50) -> dict:
+	results = {}
+	np.set_printoptions(formatter={'float': '{:.2e}'.format})
+	for env_name, env_class in _environments().items():
+		print("> %s, drift over %d steps against %r" % (env_name, horizon, REFERENCE))
+		for name in profiles:
+			profile = PhysicsProfile.get(name)
+			speed, errors = ticks_per_second(env_class, profile), drift(env_class, profile, episodes, horizon)
+			results["%s[%s]" % (env_name, name)] = {"ticks_per_sec": speed, "drift_mean": errors["mean"].tolist(), "drift_final": errors["final"].tolist()}
+			print("  %-9s %9.0f ticks/s   mean drift %s   final drift %s" % (name, speed, errors["mean"], errors["final"]))
+	return results
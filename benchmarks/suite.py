@@ -0,0 +1,275 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from benchmarks.harness import Benchmark
+
+INPUT_SPACE_SIZE = 4
+BATCH_SIZE = 128
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _cart_pole_model():
+	from apps.cart_pole.environment import create_cart_pole_model
+	return create_cart_pole_model(INPUT_SPACE_SIZE, 2)
+
+
+def _random_states(count: int) -> np.ndarray:
+	return np.random.uniform(-1., 1., (count, INPUT_SPACE_SIZE)).astype(np.float32)
+
+
+# Model inference modes (what TensorflowSpeedBenchmarkTest used to compare)
+
+def model_call_single():
+	model, datum = _cart_pole_model(), _random_states(1)
+	return lambda: model(datum)
+
+
+def model_predict_single():
+	model, datum = _cart_pole_model(), _random_states(1)
+	return lambda: model.predict(datum, verbose=0)
+
+
+def model_call_batch():
+	model, data = _cart_pole_model(), _random_states(BATCH_SIZE)
+	return lambda: model(data)
+
+
+def model_predict_on_batch():
+	model, data = _cart_pole_model(), _random_states(BATCH_SIZE)
+	return lambda: model.predict_on_batch(data)
+
+
+def numpy_policy_single():
+	from apps.utils.inference import NumpyPolicy
+	policy, datum = NumpyPolicy.from_keras(_cart_pole_model()), _random_states(1)
+	return lambda: policy(datum)
+
+
+def numpy_policy_batch():
+	from apps.utils.inference import NumpyPolicy
+	policy, data = NumpyPolicy.from_keras(_cart_pole_model()), _random_states(BATCH_SIZE)
+	return lambda: policy(data)
+
+
+# Replay memory
+
+def _filled(memory):
+	count = memory.memory_size
+	memory.remember_batch(_random_states(count), np.random.randint(0, 2, count), np.random.random(count), _random_states(count), np.zeros(count))
+	return memory
+
+
+def replay_sample():
+	from apps.utils.gym_utils import ReplayBuffer
+	memory = _filled(ReplayBuffer(100000, BATCH_SIZE, INPUT_SPACE_SIZE))
+	return memory.np_sample
+
+
+def prioritized_replay_sample_and_update():
+	from apps.utils.gym_utils import PrioritizedReplayBuffer
+	memory = _filled(PrioritizedReplayBuffer(100000, BATCH_SIZE, INPUT_SPACE_SIZE))
+
+	def run():
+		memory.np_sample()
+		memory.update_priorities(memory.last_indices, np.random.random(BATCH_SIZE))
+	return run
+
+
+def replay_remember():
+	from apps.utils.gym_utils import ReplayBuffer
+	memory = ReplayBuffer(100000, BATCH_SIZE, INPUT_SPACE_SIZE)
+	state, next_state = _random_states(1), _random_states(1)
+	return lambda: memory.remember(state, 1, 0.5, next_state, 0)
+
+
+# Physics
+
+def _physics_step(env):
+	from apps.utils.gym_utils import TIME_STEP
+	env.seed(0)
+	env.setup_environment()
+	env.new_episode_case()
+
+	def run():
+		env.play_step(env.random_input(), TIME_STEP)
+		if env.get_state() != env.STATE_RUNNING:
+			env.new_episode_case()
+	return run
+
+
+def cart_pole_play_step():
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	return _physics_step(CartPoleEnvironment_V3())
+
+
+def cart_pole_play_step_fast():
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	return _physics_step(CartPoleEnvironment_V3("fast"))
+
+
+def cart_pole_play_step_accurate():
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	return _physics_step(CartPoleEnvironment_V3("accurate"))
+
+
+def cart_play_step():
+	from apps.cart.environment import CartEnvironment_V2
+	return _physics_step(CartEnvironment_V2())
+
+
+def _cart_pole_envs(count: int):
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	envs = [CartPoleEnvironment_V3() for _ in range(count)]
+	for i, env in enumerate(envs):
+		env.seed(i)
+		env.setup_environment()
+		env.new_episode_case()
+	return envs
+
+
+def cart_pole_observe():
+	env = _cart_pole_envs(1)[0]
+	return env.observe
+
+
+def cart_pole_observe_into():
+	env = _cart_pole_envs(1)[0]
+	buffer = np.empty((1, INPUT_SPACE_SIZE), dtype=np.float32)
+	return lambda: env.observe_into(buffer)
+
+
+def cart_pole_observe_many():
+	from apps.utils.environment import BaseEnvironment
+	envs = _cart_pole_envs(16)
+	buffer = np.empty((len(envs), INPUT_SPACE_SIZE), dtype=np.float32)
+	return lambda: BaseEnvironment.observe_many(envs, buffer)
+
+
+def cart_pole_batch_step():
+	from apps.cart_pole.analytic_environment import CartPoleBatch_V3
+	from apps.utils.gym_utils import TIME_STEP
+	batch = CartPoleBatch_V3(1000)
+	batch.seed(0)
+	batch.reset()
+
+	def run():
+		batch.step(np.random.randint(0, 2, batch.size), TIME_STEP)
+		batch.reset(np.flatnonzero(batch.died))
+	return run
+
+
+# Training
+
+def _train(mode_class, **kwargs):
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	from apps.utils.gym_utils import ReplayBuffer
+	env = CartPoleEnvironment_V3()
+	mode = mode_class(env, _filled(ReplayBuffer(10000, BATCH_SIZE, INPUT_SPACE_SIZE)), **kwargs)
+	mode.seed(0)
+	return mode.train
+
+
+def dqn_train():
+	from apps.utils.learning_modes import DQN
+	return _train(DQN)
+
+
+def double_dqn_train():
+	from apps.utils.learning_modes import DoubleDQN
+	return _train(DoubleDQN)
+
+
+def dueling_dqn_train():
+	from apps.utils.learning_modes import DuelingDQN
+	return _train(DuelingDQN, tau=0.005)
+
+
+# End-to-end gym ticks
+
+def _gym_step(gym_class, envs):
+	from apps.utils.gym_utils import ReplayBuffer, TrainingSettings, Epsilon
+	from apps.utils.learning_modes import DQN
+	mode = DQN(envs[0], ReplayBuffer(10000, BATCH_SIZE, INPUT_SPACE_SIZE))
+	settings = TrainingSettings(episode_time=1000, observe=0, epsilon=Epsilon.constant(0.1), save_interval=0)
+	gym = gym_class(envs if len(envs) > 1 else envs[0], mode, settings, summary=False, seed=0)
+	return gym.step
+
+
+def base_gym_step():
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	from apps.utils.gym import BaseGym
+	return _gym_step(BaseGym, [CartPoleEnvironment_V3()])
+
+
+def vector_gym_step():
+	from apps.cart_pole.environment import CartPoleEnvironment_V3
+	from apps.utils.gym import VectorGym
+	return _gym_step(VectorGym, [CartPoleEnvironment_V3() for _ in range(16)])
+
+
+# Cold start, each run in a fresh interpreter
+
+def _cold_start(code: str):
+	env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])), TF_CPP_MIN_LOG_LEVEL="3")
+	return lambda: subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def python_startup():
+	return _cold_start("pass")
+
+
+def cold_physics_step():
+	return _cold_start(
+		"from apps.cart_pole.environment import CartPoleEnvironment_V3\n"
+		"env = CartPoleEnvironment_V3()\n"
+		"env.setup_environment()\n"
+		"env.new_episode_case()\n"
+		"env.play_step(0, 0.02)"
+	)
+
+
+def cold_gym_import():
+	return _cold_start("import apps.utils.gym")
+
+
+def cold_dqn():
+	return _cold_start(
+		"from apps.cart_pole.environment import CartPoleEnvironment_V3\n"
+		"from apps.utils.gym_utils import ReplayBuffer\n"
+		"from apps.utils.learning_modes import DQN\n"
+		"env = CartPoleEnvironment_V3()\n"
+		"DQN(env, ReplayBuffer(1000, 32))"
+	)
+
+
+BENCHMARKS = [
+	Benchmark("inference.model_call[1]", model_call_single, number=50, group="inference"),
+	Benchmark("inference.model_predict[1]", model_predict_single, number=10, group="inference"),
+	Benchmark("inference.model_call[%d]" % BATCH_SIZE, model_call_batch, number=50, group="inference"),
+	Benchmark("inference.model_predict_on_batch[%d]" % BATCH_SIZE, model_predict_on_batch, number=50, group="inference"),
+	Benchmark("inference.numpy_policy[1]", numpy_policy_single, number=1000, group="inference"),
+	Benchmark("inference.numpy_policy[%d]" % BATCH_SIZE, numpy_policy_batch, number=1000, group="inference"),
+	Benchmark("replay.remember", replay_remember, number=1000, group="replay"),
+	Benchmark("replay.sample[%d]" % BATCH_SIZE, replay_sample, number=1000, group="replay"),
+	Benchmark("replay.prioritized_sample_update[%d]" % BATCH_SIZE, prioritized_replay_sample_and_update, number=200, group="replay"),
+	Benchmark("physics.cart_pole.play_step", cart_pole_play_step, number=1000, group="physics"),
+	Benchmark("physics.cart_pole.play_step[fast]", cart_pole_play_step_fast, number=1000, group="physics"),
+	Benchmark("physics.cart_pole.play_step[accurate]", cart_pole_play_step_accurate, number=1000, group="physics"),
+	Benchmark("physics.cart.play_step", cart_play_step, number=1000, group="physics"),
+	Benchmark("physics.cart_pole_batch[1000].step", cart_pole_batch_step, number=100, group="physics"),
+	Benchmark("physics.cart_pole.observe", cart_pole_observe, number=1000, group="physics"),
+	Benchmark("physics.cart_pole.observe_into", cart_pole_observe_into, number=1000, group="physics"),
+	Benchmark("physics.cart_pole.observe_many[16]", cart_pole_observe_many, number=100, group="physics"),
+	Benchmark("train.dqn[%d]" % BATCH_SIZE, dqn_train, number=20, group="train"),
+	Benchmark("train.double_dqn[%d]" % BATCH_SIZE, double_dqn_train, number=20, group="train"),
+	Benchmark("train.dueling_dqn_polyak[%d]" % BATCH_SIZE, dueling_dqn_train, number=20, group="train"),
+	Benchmark("gym.base_gym.step", base_gym_step, number=200, group="gym"),
+	Benchmark("gym.vector_gym[16].step", vector_gym_step, number=20, group="gym"),
+	Benchmark("startup.python", python_startup, group="startup", repeats=5, warmup=1),
+	Benchmark("startup.physics_step", cold_physics_step, group="startup", repeats=5, warmup=1),
+	Benchmark("startup.import_gym", cold_gym_import, group="startup", repeats=5, warmup=1),
+	Benchmark("startup.dqn", cold_dqn, group="startup", repeats=3, warmup=1),
+]
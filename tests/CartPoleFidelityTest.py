@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pymunk
+
+from apps.cart_pole.analytic_environment import AnalyticCartPoleEnvironment_V3
+from apps.cart_pole.environment import CartPoleEnvironment_V3
+from apps.utils.environment import BaseEnvironment
+from apps.utils.gym_utils import TIME_STEP
+
+# Plays episodes in the pymunk cart-pole, then replays short stretches of them in its numpy counterpart from the same states
+# (a balanced pole is unstable, so comparing whole episodes open-loop would only measure how chaotic the system is)
+episodes = 20
+episode_time = 500
+horizon = 10  # Ticks replayed from each synced state
+tolerances = np.array([0.001, 0.01, 0.01, 0.05])  # Position, velocity, angle, angular velocity (observation units)
+reward_tolerance = 0.01
+
+random.seed(0)  # Controller noise
+pymunk_env = CartPoleEnvironment_V3()
+pymunk_env.seed(0)  # Starting states
+pymunk_env.setup_environment()
+numpy_env = AnalyticCartPoleEnvironment_V3()
+numpy_env.seed(0)
+
+max_errors = np.zeros(4)
+reward_error = 0.
+death_mismatches, replays = 0, 0
+for episode in range(episodes):
+	pymunk_env.new_episode_case()
+
+	# reset_environment leaves the pole upright above the cart whatever its angle, and still while the cart moves : pymunk then
+	# spends the first steps pulling the joint back together. Starting from a consistent state keeps that transient out of the comparison
+	pivot = pymunk_env.cart_body.position + (0, pymunk_env.cart_size[1] / 2)
+	pymunk_env.pole_body.position = pivot + pymunk.Vec2d(0, pymunk_env.pole_size[1] / 2).rotated(pymunk_env.pole_body.angle)
+	pymunk_env.pole_body.velocity = pymunk_env.cart_body.velocity
+
+	states, actions, observations, rewards, deaths = [], [], [], [], []
+	for tick in range(episode_time):
+		states.append((pymunk_env.cart_body.position.x, pymunk_env.cart_body.velocity.x, pymunk_env.pole_body.angle, pymunk_env.pole_body.angular_velocity))
+
+		# Simple balancing controller with some noise, so that episodes last long enough and cover various states
+		observation = pymunk_env.observe()[0]
+		action = int(observation[2] + 0.3 * observation[3] < 0) if random.random() > 0.2 else random.randint(0, 1)
+		pymunk_env.play_step(action, TIME_STEP)
+
+		actions.append(action)
+		observations.append(pymunk_env.observe()[0])
+		rewards.append(pymunk_env.compute_reward())
+		deaths.append(pymunk_env.get_state() == BaseEnvironment.STATE_DIED)
+		if deaths[-1]:
+			break
+
+	for start in range(0, len(actions), horizon):
+		numpy_env.new_episode_case()
+		b = numpy_env.batch
+		b.x[0], b.x_dot[0], b.theta[0], b.theta_dot[0] = states[start]
+		replays += 1
+
+		for tick in range(start, min(start + horizon, len(actions))):
+			numpy_env.play_step(actions[tick], TIME_STEP)
+			if deaths[tick] != (numpy_env.get_state() == BaseEnvironment.STATE_DIED):
+				death_mismatches += 1
+				break
+			max_errors = np.maximum(max_errors, np.abs(observations[tick] - numpy_env.observe()[0]))
+			reward_error = max(reward_error, abs(rewards[tick] - numpy_env.compute_reward()))
+
+print("Max observation errors over %d ticks (position, velocity, angle, angular velocity): " % horizon, max_errors)
+print("Max reward error: %.6f" % reward_error)
+print("Replays ending at a different tick: %d/%d" % (death_mismatches, replays))
+
+assert np.all(max_errors < tolerances), "Observations drifted apart"
+assert reward_error < reward_tolerance, "Rewards drifted apart"
+assert death_mismatches <= replays // 100, "Episodes don't end at the same time"